@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import time
+from typing import Any
+
+import asyncpg
+import discord
+
+from forms.database import create_form, delete_form, init_db
+
+from .utils import summarize
+
+
+async def bench_create_form(
+    pool: asyncpg.Pool, *, questions: int, repeat: int
+) -> dict[str, Any]:
+    items = [
+        discord.ui.TextInput(label=f'Question {number}') for number in range(questions)
+    ]
+    samples: list[float] = []
+
+    for run in range(repeat):
+        form_id = f'0benchmark{questions}-{run}'
+        start = time.perf_counter()
+        await create_form(
+            pool,
+            name=f'benchmark{questions}-{run}',
+            form_id=form_id,
+            guild_id=0,
+            response_channel_id=None,
+            creator_id=0,
+            finishes_at=discord.utils.utcnow() + datetime.timedelta(days=1),
+            questions=items,
+            allowed_users=[],
+            allowed_roles=[],
+            allow_everyone=True,
+        )
+        samples.append(time.perf_counter() - start)
+        await delete_form(pool, form_id=form_id)
+
+    return summarize('create_form', samples, questions=questions)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(prog='benchmarks.create_form')
+    parser.add_argument(
+        '--dsn',
+        help='A throwaway Postgres database, defaults to $FORMS_BENCH_DSN',
+        default=os.environ.get('FORMS_BENCH_DSN'),
+    )
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument(
+        '--questions', type=int, nargs='+', default=[1, 5, 25, 100, 500]
+    )
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(args.dsn)
+    try:
+        await init_db(pool)
+        for questions in args.questions:
+            result = await bench_create_form(
+                pool, questions=questions, repeat=args.repeat
+            )
+            print(json.dumps(result))
+    finally:
+        await pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
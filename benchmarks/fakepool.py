@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+# An in-process stand-in for asyncpg.Pool, used when no Postgres is available.
+# It understands exactly the SQL that the benchmarked parts of forms.database
+# run, so it measures the Python side of those paths (building arguments,
+# unpacking rows, aggregating and encoding) rather than the database.
+
+import collections
+import contextlib
+import re
+from typing import Any, AsyncIterator, Callable, Iterable
+
+from forms.database import FOREIGN_KEYS, PRIMARY_KEYS
+
+Row = dict[str, Any]
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def like_to_regex(pattern: str) -> re.Pattern[str]:
+    parts: list[str] = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            parts.append(re.escape(char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+class FakeDatabase:
+    def __init__(self) -> None:
+        self.forms: dict[str, Row] = {}
+        self.questions: dict[str, list[tuple[str, int]]] = {}
+        self.question_forms: dict[str, str] = {}
+        self.textinputs: dict[str, tuple[str, int]] = {}
+        self.selects: dict[str, tuple[list[str], list[str | None], str | None]] = {}
+        self.permissions: dict[str, tuple[list[int], list[int], bool]] = {}
+        # like responses_question_id_idx
+        self.responses: collections.defaultdict[
+            str, list[tuple[Any, str, str, Any]]
+        ] = collections.defaultdict(list)
+        # what the responses_tally_selects trigger maintains
+        self.tallies: collections.defaultdict[
+            str, collections.Counter[str]
+        ] = collections.defaultdict(collections.Counter)
+
+    def insert_form(self, *args: Any) -> None:
+        name, form_id, guild_id, response_channel_id, creator_id, finishes_at = args
+        self.forms[form_id] = {
+            'form_name': name,
+            'form_id': form_id,
+            'guild_id': guild_id,
+            'response_channel_id': response_channel_id,
+            'creator_id': creator_id,
+            'finishes_at': finishes_at,
+        }
+
+    def insert_questions(
+        self, form_id: str, question_ids: list[str], item_types: list[int]
+    ) -> None:
+        self.questions[form_id] = list(zip(question_ids, item_types))
+        for question_id in question_ids:
+            self.question_forms[question_id] = form_id
+
+    def insert_textinputs(
+        self, question_ids: list[str], names: list[str], types: list[int]
+    ) -> None:
+        for question_id, name, input_type in zip(question_ids, names, types):
+            self.textinputs[question_id] = (name, input_type)
+
+    def insert_permissions(
+        self, form_id: str, users: list[int], roles: list[int], everyone: bool
+    ) -> None:
+        self.permissions[form_id] = (users, roles, everyone)
+
+    def insert_responses(self, rows: Iterable[tuple[Any, ...]]) -> int:
+        count = 0
+        for question_id, response_time, response, username, submission_id in rows:
+            if question_id in self.question_forms:
+                self.responses[question_id].append(
+                    (response_time, response, username, submission_id)
+                )
+                if question_id in self.selects:
+                    self.tallies[question_id][response] += 1
+                count += 1
+        return count
+
+    def delete_form(self, form_id: str) -> int | None:
+        form = self.forms.pop(form_id, None)
+        if form is None:
+            return None
+        for question_id, _ in self.questions.pop(form_id, []):
+            del self.question_forms[question_id]
+            self.textinputs.pop(question_id, None)
+            self.selects.pop(question_id, None)
+            self.responses.pop(question_id, None)
+            self.tallies.pop(question_id, None)
+        self.permissions.pop(form_id, None)
+        return form['guild_id']
+
+    def get_questions(self, form_id: str) -> list[Row]:
+        rows = []
+        for question_id, item_type in sorted(self.questions.get(form_id, [])):
+            input_name, input_type = self.textinputs.get(question_id, (None, None))
+            labels, descriptions, placeholder = self.selects.get(
+                question_id, (None, None, None)
+            )
+            rows.append(
+                {
+                    'question_id': question_id,
+                    'item_type': item_type,
+                    'input_name': input_name,
+                    'input_type': input_type,
+                    'labels': labels,
+                    'descriptions': descriptions,
+                    'placeholder': placeholder,
+                }
+            )
+        return rows
+
+    def get_question_names(self, form_ids: list[str]) -> list[Row]:
+        rows = []
+        for form_id in sorted(form_ids):
+            for question in self.get_questions(form_id):
+                rows.append(
+                    {
+                        'form_id': form_id,
+                        'question_id': question['question_id'],
+                        'item_type': question['item_type'],
+                        'name': question['input_name'] or question['placeholder'],
+                    }
+                )
+        return rows
+
+    def get_constraints(self) -> list[Row]:
+        # the fake schema is always current, so migrate_keys has nothing to do
+        return [
+            *({'conname': f'{table}_pkey'} for table in PRIMARY_KEYS),
+            *({'conname': f'{table}_{column}_fkey'} for table, column in FOREIGN_KEYS),
+        ]
+
+    def get_select_tallies(self, question_ids: list[str]) -> list[Row]:
+        return [
+            {'question_id': question_id, 'response': response, 'count': count}
+            for question_id in sorted(question_ids)
+            for response, count in sorted(self.tallies[question_id].items())
+        ]
+
+    def search_forms(
+        self, guild_id: int, pattern: str, user_id: int, role_ids: list[int], limit: int
+    ) -> list[Row]:
+        regex = like_to_regex(pattern)
+        names = []
+        for form_id, form in self.forms.items():
+            if form['guild_id'] != guild_id or not regex.fullmatch(
+                form['form_name'].lower()
+            ):
+                continue
+            users, roles, everyone = self.permissions[form_id]
+            if everyone or user_id in users or set(roles) & set(role_ids):
+                names.append(form['form_name'])
+        names.sort(key=str.lower)
+        return [{'form_name': name} for name in names[:limit]]
+
+    def iter_submissions(self, form_ids: list[str]) -> list[Row]:
+        rows = []
+        for form_id in sorted(form_ids):
+            submissions: dict[tuple[Any, ...], list[tuple[str, str]]] = {}
+            for question_id, _ in self.questions.get(form_id, []):
+                for response_time, response, username, submission_id in self.responses[
+                    question_id
+                ]:
+                    key = (submission_id, response_time, username)
+                    submissions.setdefault(key, []).append((question_id, response))
+            for (submission_id, response_time, username), answers in sorted(
+                submissions.items(), key=lambda item: item[0][1]
+            ):
+                answers.sort()
+                rows.append(
+                    {
+                        'form_id': form_id,
+                        'submission_id': submission_id,
+                        'username': username,
+                        'response_time': response_time,
+                        'question_ids': [question_id for question_id, _ in answers],
+                        'responses': [response for _, response in answers],
+                    }
+                )
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, database: FakeDatabase) -> None:
+        self.database = database
+        # (query prefix, handler) for every statement the benchmarks run
+        self.handlers: list[tuple[str, Callable[..., Any]]] = [
+            ('CREATE ', lambda *args: None),
+            ('ALTER TABLE', lambda *args: None),
+            ('DROP TRIGGER', lambda *args: None),
+            ('SELECT pg_advisory_xact_lock', lambda *args: None),
+            ('SELECT to_regclass', lambda *args: False),
+            ('SELECT EXISTS ( SELECT 1 FROM pg_trigger', lambda *args: True),
+            ('SELECT c.conname FROM pg_constraint', database.get_constraints),
+            ('SELECT pg_notify', lambda *args: None),
+            ('INSERT INTO forms VALUES', database.insert_form),
+            ('INSERT INTO questions SELECT', database.insert_questions),
+            ('INSERT INTO textinputs SELECT', database.insert_textinputs),
+            ('INSERT INTO permissions VALUES', database.insert_permissions),
+            (
+                'INSERT INTO responses (question_id, response_time, response, username, submission_id) SELECT',
+                lambda *columns: database.insert_responses(zip(*columns)),
+            ),
+            ('DELETE FROM forms WHERE form_id = $1', database.delete_form),
+            ('SELECT q.question_id, q.item_type', database.get_questions),
+            ('SELECT q.form_id, q.question_id', database.get_question_names),
+            ('SELECT q.form_id, r.submission_id', database.iter_submissions),
+            ('SELECT f.form_name FROM forms f', database.search_forms),
+            ('SELECT question_id, response, count', database.get_select_tallies),
+        ]
+
+    def run(self, query: str, *args: Any) -> Any:
+        query = WHITESPACE.sub(' ', query).strip()
+        for prefix, handler in self.handlers:
+            if query.startswith(prefix):
+                return handler(*args)
+        raise NotImplementedError(f'The fake pool does not understand {query!r}')
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        yield
+
+    async def execute(self, query: str, *args: Any, **kwargs: Any) -> str:
+        rows = self.run(query, *args)
+        return f'INSERT 0 {rows}' if isinstance(rows, int) else 'OK'
+
+    async def executemany(
+        self, command: str, args: Iterable[tuple[Any, ...]], **kwargs: Any
+    ) -> None:
+        command = WHITESPACE.sub(' ', command).strip()
+        if command.startswith('INSERT INTO selects VALUES'):
+            for question_id, labels, descriptions, placeholder in args:
+                self.database.selects[question_id] = (
+                    labels,
+                    descriptions,
+                    placeholder,
+                )
+        else:
+            for arguments in args:
+                self.run(command, *arguments)
+
+    async def fetch(self, query: str, *args: Any, **kwargs: Any) -> list[Row]:
+        return self.run(query, *args)
+
+    async def fetchrow(self, query: str, *args: Any, **kwargs: Any) -> Row | None:
+        rows = self.run(query, *args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        return self.run(query, *args)
+
+    async def cursor(
+        self, query: str, *args: Any, prefetch: int | None = None, **kwargs: Any
+    ) -> AsyncIterator[Row]:
+        for row in self.run(query, *args):
+            yield row
+
+    async def copy_records_to_table(
+        self, table_name: str, *, records: Iterable[tuple[Any, ...]], **kwargs: Any
+    ) -> str:
+        if table_name != 'responses':
+            raise NotImplementedError('The fake pool can only copy into responses')
+        return f'COPY {self.database.insert_responses(records)}'
+
+
+class FakePool:
+    def __init__(self) -> None:
+        self.database = FakeDatabase()
+        self.connection = FakeConnection(self.database)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[FakeConnection]:
+        yield self.connection
+
+    async def close(self) -> None:
+        pass
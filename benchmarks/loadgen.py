@@ -0,0 +1,427 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from typing import Any
+
+import aiohttp
+import asyncpg
+import discord
+from aiohttp import web
+from nacl.signing import SigningKey
+
+from forms.database import init_db
+
+from .suite import GUILD_ID, seed_form
+from .utils import summarize
+
+APPLICATION_ID = 100000000000000000
+USER_ID = 200000000000000000
+SCENARIOS = ('autocomplete', 'takeform', 'finish')
+
+ids = itertools.count(int(time.time() * 1000) << 22)
+
+
+def get_user(user_id: int, name: str, *, bot: bool = False) -> dict[str, Any]:
+    return {
+        'id': str(user_id),
+        'username': name,
+        'discriminator': '0',
+        'global_name': None,
+        'avatar': None,
+        'bot': bot,
+    }
+
+
+def json_response(data: Any, *, status: int = 200) -> web.Response:
+    # discord.py only decodes an exact application/json content type
+    return web.Response(
+        body=json.dumps(data).encode(), status=status, content_type='application/json'
+    )
+
+
+class FakeDiscordAPI:
+    # just enough of the REST API for the bot to log in and answer interactions
+    def __init__(self, verify_key: str, *, latency: float = 0) -> None:
+        self.verify_key = verify_key
+        self.latency = latency
+        self.modals: dict[str, dict[str, Any]] = {}
+        self.requests: collections.Counter[str] = collections.Counter()
+        self.app = web.Application(client_max_size=1024**3)
+        self.app.router.add_route('*', '/api/v{version}/{path:.*}', self.handler)
+
+    def get_message(self, channel_id: str) -> dict[str, Any]:
+        return {
+            'id': str(next(ids)),
+            'channel_id': channel_id,
+            'author': get_user(APPLICATION_ID, 'Forms', bot=True),
+            'content': '',
+            'timestamp': discord.utils.utcnow().isoformat(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'pinned': False,
+            'type': 0,
+        }
+
+    async def handler(self, request: web.Request) -> web.Response:
+        path = request.match_info['path']
+        parts = path.split('/')
+        body = await request.read()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        route = ['{id}' if part.isdigit() else part for part in parts]
+        if parts[0] in ('interactions', 'webhooks') and len(parts) > 2:
+            route[2] = '{token}'
+        self.requests[f'{request.method} /{"/".join(route)}'] += 1
+
+        if request.method == 'GET' and path == 'users/@me':
+            return json_response(get_user(APPLICATION_ID, 'Forms', bot=True))
+        if request.method == 'GET' and path == 'oauth2/applications/@me':
+            return json_response(
+                {
+                    'id': str(APPLICATION_ID),
+                    'name': 'Forms',
+                    'icon': None,
+                    'description': '',
+                    'bot_public': True,
+                    'bot_require_code_grant': False,
+                    'owner': get_user(USER_ID, 'owner'),
+                    'verify_key': self.verify_key,
+                    'flags': 0,
+                }
+            )
+        if request.method == 'GET' and parts[-1] == 'commands':
+            return json_response([])
+        if request.method == 'GET' and parts[0] == 'users':
+            return json_response(get_user(int(parts[1]), 'user'))
+        if request.method == 'POST' and path == 'users/@me/channels':
+            recipient = json.loads(body)['recipient_id']
+            return json_response(
+                {
+                    'id': str(next(ids)),
+                    'type': 1,
+                    'recipients': [get_user(int(recipient), 'user')],
+                }
+            )
+        if parts[0] == 'interactions' and parts[-1] == 'callback':
+            if body.startswith(b'{'):
+                payload = json.loads(body)
+                if payload['type'] == 9:  # modal
+                    self.modals[parts[1]] = payload['data']
+            return web.Response(status=204)
+        if request.method == 'POST' and parts[-1] == 'typing':
+            return web.Response(status=204)
+        if request.method == 'POST' and parts[-1] == 'messages':
+            return json_response(self.get_message(parts[1]))
+        if request.method == 'POST' and parts[0] == 'webhooks':
+            return json_response(self.get_message('0'))
+        return json_response({'message': 'Unknown', 'code': 0}, status=404)
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        api: FakeDiscordAPI,
+        signing_key: SigningKey,
+        *,
+        target: str,
+        form_names: list[str],
+        finish_names: list[str],
+    ) -> None:
+        self.session = session
+        self.api = api
+        self.signing_key = signing_key
+        self.target = target
+        self.form_names = form_names
+        self.finish_names = finish_names
+        self.samples: collections.defaultdict[
+            str, list[float]
+        ] = collections.defaultdict(list)
+        self.errors: collections.Counter[str] = collections.Counter()
+
+    def get_interaction(
+        self, interaction_type: int, data: dict[str, Any]
+    ) -> dict[str, Any]:
+        return {
+            'id': str(next(ids)),
+            'application_id': str(APPLICATION_ID),
+            'type': interaction_type,
+            'data': data,
+            'guild_id': str(GUILD_ID),
+            'channel_id': str(GUILD_ID),
+            'member': {
+                'user': get_user(USER_ID, 'loadgen'),
+                'roles': [],
+                'joined_at': '2022-01-01T00:00:00+00:00',
+                'deaf': False,
+                'mute': False,
+                'flags': 0,
+                'permissions': '0',
+            },
+            'token': f'token{next(ids)}',
+            'version': 1,
+            'locale': 'en-US',
+            'app_permissions': '0',
+        }
+
+    def get_command(
+        self, name: str, options: list[dict[str, Any]], *, autocomplete: bool = False
+    ) -> dict[str, Any]:
+        return self.get_interaction(
+            4 if autocomplete else 2,
+            {'id': str(APPLICATION_ID), 'name': name, 'type': 1, 'options': options},
+        )
+
+    async def send(self, kind: str, payload: dict[str, Any]) -> bool:
+        body = json.dumps(payload)
+        timestamp = str(int(time.time()))
+        signature = self.signing_key.sign(f'{timestamp}{body}'.encode()).signature
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Signature-Ed25519': signature.hex(),
+            'X-Signature-Timestamp': timestamp,
+        }
+        start = time.perf_counter()
+        try:
+            async with self.session.post(
+                self.target, data=body, headers=headers
+            ) as response:
+                await response.read()
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            ok = False
+        if ok:
+            self.samples[kind].append(time.perf_counter() - start)
+        else:
+            self.errors[kind] += 1
+        return ok
+
+    async def autocomplete(self) -> None:
+        prefix = random.choice(self.form_names)[: random.randint(0, 8)]
+        await self.send(
+            'autocomplete',
+            self.get_command(
+                'takeform',
+                [{'name': 'form_name', 'type': 3, 'value': prefix, 'focused': True}],
+                autocomplete=True,
+            ),
+        )
+
+    async def takeform(self) -> None:
+        payload = self.get_command(
+            'takeform',
+            [{'name': 'form_name', 'type': 3, 'value': random.choice(self.form_names)}],
+        )
+        if not await self.send('takeform', payload):
+            return
+        # the modal was sent to the fake API before the response came back
+        modal = self.api.modals.pop(payload['id'], None)
+        if modal is None:
+            self.errors['modal_submit'] += 1
+            return
+        components = [
+            {
+                'type': 1,
+                'components': [
+                    {
+                        'type': component['type'],
+                        'custom_id': component['custom_id'],
+                        'value': 'A synthetic answer',
+                    }
+                    for component in row['components']
+                ],
+            }
+            for row in modal['components']
+        ]
+        await self.send(
+            'modal_submit',
+            self.get_interaction(
+                5, {'custom_id': modal['custom_id'], 'components': components}
+            ),
+        )
+
+    async def finish(self) -> None:
+        if not self.finish_names:
+            await self.autocomplete()  # every seeded form has been finished
+            return
+        await self.send(
+            'finish',
+            self.get_command(
+                'finish',
+                [
+                    {
+                        'name': 'form_name',
+                        'type': 3,
+                        'value': self.finish_names.pop(),
+                    }
+                ],
+            ),
+        )
+
+    async def worker(self, deadline: float, weights: list[float]) -> None:
+        scenarios = [self.autocomplete, self.takeform, self.finish]
+        while time.perf_counter() < deadline:
+            await random.choices(scenarios, weights)[0]()
+
+    async def run_level(
+        self, concurrency: int, duration: float, weights: list[float]
+    ) -> list[dict[str, Any]]:
+        self.samples.clear()
+        self.errors.clear()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(self.worker(start + duration, weights) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+
+        results = []
+        for kind in sorted(set(self.samples) | set(self.errors)):
+            samples = self.samples[kind]
+            extra = {
+                'kind': kind,
+                'concurrency': concurrency,
+                'requests_per_second': len(samples) / elapsed,
+                'errors': self.errors[kind],
+            }
+            if samples:
+                results.append(summarize('loadgen', samples, **extra))
+            else:
+                results.append({'benchmark': 'loadgen', **extra, 'runs': 0})
+        return results
+
+
+async def wait_for_target(
+    session: aiohttp.ClientSession, target: str, timeout: float
+) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            # an unsigned request is rejected, which is enough to know it's up
+            async with session.post(target, data='{}') as response:
+                if response.status == 401:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f'{target} did not come up in {timeout}s')
+        await asyncio.sleep(1)
+
+
+async def run(args: argparse.Namespace) -> None:
+    signing_key = SigningKey.generate()
+    api = FakeDiscordAPI(
+        signing_key.verify_key.encode().hex(), latency=args.api_latency / 1000
+    )
+    runner = web.AppRunner(api.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+    print(
+        f'Fake Discord API on http://127.0.0.1:{args.api_port}/api/v10, set it as '
+        'api_base_url in the config and start the bot with --web',
+        file=sys.stderr,
+    )
+
+    pool = await asyncpg.create_pool(args.dsn)
+    try:
+        await init_db(pool)
+        run_id = next(ids)
+        text_only = [discord.ui.TextInput(label=f'Question {n}') for n in range(4)]
+        form_names: list[str] = []
+        for number in range(args.forms):
+            await seed_form(pool, name=f'load {run_id} {number}', items=text_only)
+            form_names.append(f'load {run_id} {number}')
+        finish_names: list[str] = []
+        for number in range(args.finish_forms):
+            await seed_form(
+                pool,
+                name=f'finish {run_id} {number}',
+                responses=args.responses,
+                creator_id=USER_ID,
+            )
+            finish_names.append(f'finish {run_id} {number}')
+    finally:
+        await pool.close()
+
+    async with aiohttp.ClientSession() as session:
+        await wait_for_target(session, args.target, args.startup_timeout)
+        generator = LoadGenerator(
+            session,
+            api,
+            signing_key,
+            target=args.target,
+            form_names=form_names,
+            finish_names=finish_names,
+        )
+        for concurrency in args.concurrency:
+            for result in await generator.run_level(
+                concurrency, args.duration, args.weights
+            ):
+                print(json.dumps(result), flush=True)
+
+    print(json.dumps({'benchmark': 'loadgen_api', **api.requests}), flush=True)
+    await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='benchmarks.loadgen',
+        description=(
+            'Send signed interactions to a bot running with --web and report '
+            'throughput and tail latency at increasing concurrency.'
+        ),
+    )
+    parser.add_argument(
+        '--target',
+        default='http://127.0.0.1:8080/api/interactions',
+        help='The bot\'s interactions endpoint',
+    )
+    parser.add_argument(
+        '--dsn',
+        help='The bot\'s database, used to seed forms. Defaults to $FORMS_BENCH_DSN',
+        default=os.environ.get('FORMS_BENCH_DSN'),
+    )
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument(
+        '--api-latency',
+        type=float,
+        default=0,
+        help='Milliseconds the fake Discord API waits before answering',
+    )
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=[1, 4, 16, 64, 256]
+    )
+    parser.add_argument(
+        '--duration', type=float, default=10, help='Seconds per concurrency level'
+    )
+    parser.add_argument(
+        '--weights',
+        type=float,
+        nargs=len(SCENARIOS),
+        default=[0.6, 0.35, 0.05],
+        help='Relative weights of the autocomplete, takeform and finish scenarios',
+    )
+    parser.add_argument('--forms', type=int, default=100)
+    parser.add_argument('--finish-forms', type=int, default=50)
+    parser.add_argument(
+        '--responses', type=int, default=1000, help='Responses per finished form'
+    )
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator
+
+import asyncpg
+import discord
+
+from forms.commands.forms import form_name_autocomplete
+from forms.constants import RESPONSE_BUFFER_SIZE
+from forms.database import (
+    FormsConnection,
+    autocomplete_cache,
+    create_form,
+    delete_form,
+    get_questions,
+    init_db,
+    prepare_statements,
+)
+from forms.finish_form import FINISH_STAGES, FinishingPipeline, FinishRequest
+from forms.ingest import ResponseBuffer
+
+from .create_form import bench_create_form
+from .fakepool import FakePool
+from .utils import summarize
+
+SCHEMA = 'forms_benchmark'
+GUILD_ID = 1
+QUESTIONS = 5  # four text inputs and one select, see get_items
+OPTIONS = ['red', 'green', 'blue']
+
+
+def get_items() -> list[discord.ui.TextInput | discord.ui.Select]:
+    return [
+        *(discord.ui.TextInput(label=f'Question {number}') for number in range(4)),
+        discord.ui.Select(
+            placeholder='Favourite colour',
+            options=[discord.SelectOption(label=option) for option in OPTIONS],
+        ),
+    ]
+
+
+def get_responses(form_id: str, responses: int) -> Iterator[tuple[Any, ...]]:
+    start = discord.utils.utcnow() - datetime.timedelta(days=1)
+    for number in range(responses // QUESTIONS):
+        submission_id = uuid.uuid4()
+        response_time = start + datetime.timedelta(milliseconds=number)
+        for question in range(QUESTIONS):
+            if question == QUESTIONS - 1:
+                response = OPTIONS[number % len(OPTIONS)]
+            else:
+                response = f'Answer {number} to question {question}'
+            yield (
+                f'{form_id}{question}',
+                response_time,
+                response,
+                f'user{number}',
+                submission_id,
+            )
+
+
+async def seed_form(
+    pool: Any,
+    *,
+    name: str,
+    responses: int = 0,
+    guild_id: int = GUILD_ID,
+    creator_id: int = 0,
+    items: list[discord.ui.TextInput | discord.ui.Select] | None = None,
+) -> str:
+    form_id = f'{guild_id}{name}'
+    await create_form(
+        pool,
+        name=name,
+        form_id=form_id,
+        guild_id=guild_id,
+        response_channel_id=None,
+        creator_id=creator_id,
+        finishes_at=discord.utils.utcnow() + datetime.timedelta(days=1),
+        questions=get_items() if items is None else items,
+        allowed_users=[],
+        allowed_roles=[],
+        allow_everyone=True,
+    )
+    if responses:
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                'responses',
+                records=get_responses(form_id, responses),
+                columns=[
+                    'question_id',
+                    'response_time',
+                    'response',
+                    'username',
+                    'submission_id',
+                ],
+            )
+    return form_id
+
+
+class StubChannel:
+    # reads every attachment like an upload would, without touching Discord
+    def __init__(self) -> None:
+        self.messages = 0
+        self.bytes_sent = 0
+
+    async def send(self, **kwargs: Any) -> None:
+        files = kwargs.get('files') or ([kwargs['file']] if 'file' in kwargs else [])
+        for file in files:
+            self.bytes_sent += len(file.fp.read())
+            file.close()
+        self.messages += 1
+
+    @contextlib.asynccontextmanager
+    async def typing(self) -> AsyncIterator[None]:
+        yield
+
+
+class StubRenderer:
+    async def render_many(self, charts: Any) -> list[bytes]:
+        return [b'' for _ in charts]
+
+
+class StubBuffer:
+    async def flush(self) -> None:
+        pass
+
+
+class StubBot:
+    def __init__(self, pool: Any, *, render_charts: bool) -> None:
+        self.pool = pool
+        self.response_buffer = StubBuffer()
+        if render_charts:
+            from forms.charts import ChartRenderer
+
+            self.chart_renderer: Any = ChartRenderer()
+        else:
+            self.chart_renderer = StubRenderer()
+
+
+class StubMember:
+    def __init__(self) -> None:
+        self.id = 0
+        self.guild = discord.Object(id=GUILD_ID)
+        self.roles: list[discord.Object] = []
+
+
+class StubInteraction:
+    def __init__(self, pool: Any) -> None:
+        self.client = StubBot(pool, render_charts=False)
+        self.user = StubMember()
+
+
+async def bench_buffered_responses(
+    pool: Any, *, form_id: str, repeat: int, batch: int = RESPONSE_BUFFER_SIZE
+) -> dict[str, Any]:
+    # the size trigger is out of reach so each sample is one whole batch
+    buffer = ResponseBuffer(pool, max_size=batch * QUESTIONS + 1)
+    question_ids = [f'{form_id}{question}' for question in range(QUESTIONS)]
+    answers = ['an answer'] * (QUESTIONS - 1) + [OPTIONS[0]]
+    samples: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for number in range(batch):
+            buffer.add(
+                response_time=discord.utils.utcnow(),
+                user=f'user{number}',
+                question_ids=question_ids,
+                responses=answers,
+            )
+        await buffer.flush()
+        samples.append(time.perf_counter() - start)
+    return summarize(
+        'buffered_responses', samples, questions=QUESTIONS, submissions=batch
+    )
+
+
+async def bench_get_questions(
+    pool: Any, *, form_id: str, repeat: int
+) -> dict[str, Any]:
+    samples: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        [item async for item in get_questions(pool, form_id=form_id)]
+        samples.append(time.perf_counter() - start)
+    return summarize('get_questions', samples, questions=QUESTIONS)
+
+
+async def bench_autocomplete(
+    pool: Any, *, forms: int, repeat: int, cached: bool
+) -> dict[str, Any]:
+    interaction: Any = StubInteraction(pool)
+    prefixes = ['', 'b', 'bench', 'benchmark 1', 'benchmark 12', 'nothing']
+    samples: list[float] = []
+    for number in range(repeat):
+        if not cached:
+            autocomplete_cache.clear()
+        start = time.perf_counter()
+        await form_name_autocomplete(interaction, prefixes[number % len(prefixes)])
+        samples.append(time.perf_counter() - start)
+    return summarize('form_name_autocomplete', samples, forms=forms, cached=cached)
+
+
+async def bench_finish(
+    pool: Any, *, form_id: str, responses: int, repeat: int, render_charts: bool
+) -> dict[str, Any]:
+    bot: Any = StubBot(pool, render_charts=render_charts)
+    pipeline = FinishingPipeline(bot)
+    samples: list[float] = []
+    stages = dict.fromkeys(FINISH_STAGES, 0.0)
+    channel = StubChannel()
+    try:
+        for _ in range(repeat):
+            timings = dict.fromkeys(FINISH_STAGES, 0.0)
+            request = FinishRequest(
+                form_id=form_id,
+                form_name=form_id,
+                guild_id=GUILD_ID,
+                creator_id=0,
+                channel=channel,  # type: ignore
+            )
+            start = time.perf_counter()
+            # finish_batch leaves the form in place, run would delete it
+            await pipeline.finish_batch([request], timings)
+            samples.append(time.perf_counter() - start)
+            for stage, seconds in timings.items():
+                stages[stage] += seconds
+    finally:
+        if render_charts:
+            bot.chart_renderer.close()
+
+    return summarize(
+        'finish_form',
+        samples,
+        responses=responses,
+        bytes_sent=channel.bytes_sent // repeat,
+        **{f'{stage}_ms': seconds / repeat * 1000 for stage, seconds in stages.items()},
+    )
+
+
+@contextlib.asynccontextmanager
+async def open_pool(dsn: str | None) -> AsyncIterator[Any]:
+    if dsn is None:
+        yield FakePool()
+        return
+
+    # everything lives in its own schema, dropped afterwards
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await conn.execute(f'CREATE SCHEMA {SCHEMA}')
+        pool = await asyncpg.create_pool(
+            dsn,
+            server_settings={'search_path': SCHEMA},
+            connection_class=FormsConnection,
+            init=prepare_statements,
+        )
+        try:
+            yield pool
+        finally:
+            await pool.close()
+    finally:
+        await conn.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await conn.close()
+
+
+async def run(args: argparse.Namespace) -> list[dict[str, Any]]:
+    backend = 'fake' if args.dsn is None else 'postgres'
+    results: list[dict[str, Any]] = []
+
+    def report(result: dict[str, Any]) -> None:
+        result = {'backend': backend, **result}
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    async with open_pool(args.dsn) as pool:
+        await init_db(pool)
+
+        report(await bench_create_form(pool, questions=QUESTIONS, repeat=args.repeat))
+
+        form_id = await seed_form(pool, name='insert target')
+        report(
+            await bench_buffered_responses(pool, form_id=form_id, repeat=args.repeat)
+        )
+        report(await bench_get_questions(pool, form_id=form_id, repeat=args.repeat))
+        await delete_form(pool, form_id=form_id)
+
+        for number in range(args.forms):
+            await seed_form(pool, name=f'benchmark {number}')
+        for cached in (False, True):
+            report(
+                await bench_autocomplete(
+                    pool, forms=args.forms, repeat=args.repeat, cached=cached
+                )
+            )
+
+        for responses in args.responses:
+            form_id = await seed_form(
+                pool, name=f'finish {responses}', responses=responses
+            )
+            report(
+                await bench_finish(
+                    pool,
+                    form_id=form_id,
+                    responses=responses,
+                    repeat=args.finish_repeat,
+                    render_charts=args.render_charts,
+                )
+            )
+            await delete_form(pool, form_id=form_id)
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='benchmarks.suite',
+        description='Benchmark the database and finishing hot paths.',
+    )
+    parser.add_argument(
+        '--dsn',
+        help=(
+            'A throwaway Postgres database, defaults to $FORMS_BENCH_DSN. '
+            'An in-process fake pool is used without one.'
+        ),
+        default=os.environ.get('FORMS_BENCH_DSN'),
+    )
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--finish-repeat', type=int, default=3)
+    parser.add_argument('--forms', type=int, default=1000)
+    parser.add_argument(
+        '--responses', type=int, nargs='+', default=[1000, 100000, 1000000]
+    )
+    parser.add_argument(
+        '--render-charts',
+        action='store_true',
+        help='Render the charts when finishing instead of stubbing the renderer',
+    )
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        document = {
+            'created_at': discord.utils.utcnow().isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'arguments': vars(args) | {'dsn': args.dsn and '<redacted>'},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+import statistics
+from typing import Any
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[max(0, round(len(ordered) * fraction) - 1)]
+
+
+def summarize(benchmark: str, samples: list[float], **extra: Any) -> dict[str, Any]:
+    ordered = sorted(samples)
+    return {
+        'benchmark': benchmark,
+        **extra,
+        'runs': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': statistics.median(samples) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
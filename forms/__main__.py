@@ -1,13 +1,23 @@
 import argparse
 import asyncio
+import time
 
-import discord
 
-from .bot import FormsBot
+def print_timings(timings: dict[str, float]) -> None:
+    width = max(map(len, timings))
+    for name, seconds in timings.items():
+        print(f'{name:<{width}}  {seconds * 1000:9.1f}ms')
 
 
 def main() -> None:
+    start = time.perf_counter()
     parser = argparse.ArgumentParser(prog='forms')
+    parser.add_argument(
+        'mode',
+        help='Run a background worker that finishes forms instead of the bot',
+        nargs='?',
+        choices=['worker'],
+    )
     parser.add_argument(
         '-l',
         '--logging',
@@ -40,18 +50,41 @@ def main() -> None:
         dest='ngrok',
         action='store_true',
     )
+    parser.add_argument(
+        '--startup-profile',
+        help='Log in, print import and setup_hook timings and exit',
+        default=False,
+        dest='startup_profile',
+        action='store_true',
+    )
     args = parser.parse_args()
 
+    # imported here so the startup profile's import phase includes them
+    import discord
+
     if args.logging:
         discord.utils.setup_logging()
 
+    from .bot import FormsBot
+
+    import_time = time.perf_counter() - start
+
     bot = FormsBot()
     bot.use_ngrok = args.ngrok
 
+    if args.startup_profile:
+        timings = {'import': import_time}
+        timings.update(asyncio.run(bot.profile_startup()))
+        timings['total'] = time.perf_counter() - start
+        print_timings(timings)
+        return
+
     if args.web and args.gateway:
         raise TypeError('Cannot use both --web and --gateway')
 
-    if args.web:
+    if args.mode == 'worker':
+        asyncio.run(bot.run_as_worker())
+    elif args.web:
         asyncio.run(bot.run_with_web())
     else:
         asyncio.run(bot.run_with_gateway())
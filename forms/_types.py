@@ -8,24 +8,53 @@ from typing import (
 import discord
 
 if TYPE_CHECKING:
+    import asyncpg
+
     from .bot import FormsBot
+    from .router import DatabaseRouter
 
 
 Color: TypeAlias = int | discord.Color
 Item: TypeAlias = discord.ui.TextInput | discord.ui.Select
+Pool: TypeAlias = 'asyncpg.Pool | DatabaseRouter'
 
 
 class ConfigData(TypedDict):
     token: str
+    api_base_url: NotRequired[str]
     host: str
     port: int
     user: str
     password: str
+    pool_min_size: NotRequired[int]
+    pool_max_size: NotRequired[int]
+    pool_max_inactive_connection_lifetime: NotRequired[float]
+    command_timeout: NotRequired[float]
+    statement_cache_size: NotRequired[int]
+    slow_query_threshold: NotRequired[float]
+    profiling_token: NotRequired[str]
+    metrics_token: NotRequired[str]
+    loop_lag_threshold: NotRequired[float]
+    trace_sample_rate: NotRequired[float]
+    trace_file: NotRequired[str]
+    trace_otlp_endpoint: NotRequired[str]
+    replica_dsns: NotRequired[list[str]]
+    replica_health_check_interval: NotRequired[float]
     error_channel: NotRequired[int]
     reports_channel: NotRequired[int]
     invite_url: NotRequired[str]
     website_url: NotRequired[str]
     ngrok_auth_token: NotRequired[str]
+    chart_workers: NotRequired[int]
+    chart_cache_size: NotRequired[int]
+    chart_cache_dir: NotRequired[str]
+    chart_cache_dir_size: NotRequired[int]
+    finish_concurrency: NotRequired[int]
+    finish_queue_size: NotRequired[int]
+    finish_batch_size: NotRequired[int]
+    finish_in_worker: NotRequired[bool]
+    response_buffer_size: NotRequired[int]
+    response_flush_interval: NotRequired[float]
 
 
 class Interaction(discord.Interaction):
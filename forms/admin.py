@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import io
+import textwrap
+from typing import TYPE_CHECKING, Literal
+
+import discord
+from discord.ext import commands
+
+from .constants import PROFILE_MAX_SECONDS, PROFILE_SECONDS
+from .profiling import profile_cpu, profile_lock, profile_memory
+from .querylog import query_log
+
+if TYPE_CHECKING:
+    from .bot import FormsBot
+
+
+@commands.command(name='querystats')
+@commands.is_owner()
+async def query_stats_command(ctx: commands.Context[FormsBot], limit: int = 10) -> None:
+    # also readable from jishaku with forms.querylog.query_log.stats()
+    stats = query_log.stats()[:limit]
+    if not stats:
+        await ctx.send('No queries have been run yet.')
+        return
+
+    paginator = commands.Paginator(prefix='```sql', suffix='```')
+    for stat in stats:
+        paginator.add_line(
+            f'-- {stat.count} calls, {stat.total * 1000:.0f}ms total, '
+            f'p50 {stat.p50 * 1000:.1f}ms, p95 {stat.p95 * 1000:.1f}ms, '
+            f'p99 {stat.p99 * 1000:.1f}ms'
+        )
+        paginator.add_line(textwrap.shorten(stat.query, width=500))
+        paginator.add_line()
+    for page in paginator.pages:
+        await ctx.send(page)
+
+
+async def send_profile(
+    ctx: commands.Context[FormsBot], text: str, filename: str
+) -> None:
+    await ctx.send(file=discord.File(io.BytesIO(text.encode()), filename=filename))
+
+
+async def check_profile_seconds(
+    ctx: commands.Context[FormsBot], seconds: float
+) -> bool:
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await ctx.send(f'Profile for between 0 and {PROFILE_MAX_SECONDS} seconds.')
+        return False
+    if profile_lock.locked():
+        await ctx.send('A profile is already running.')
+        return False
+    return True
+
+
+@commands.command(name='profile')
+@commands.is_owner()
+async def profile_command(
+    ctx: commands.Context[FormsBot],
+    seconds: float = PROFILE_SECONDS,
+    output: Literal['pstats', 'collapsed'] = 'pstats',
+) -> None:
+    if not await check_profile_seconds(ctx, seconds):
+        return
+    await ctx.send(f'Profiling for {seconds} seconds...')
+    text = await profile_cpu(seconds, output=output)
+    await send_profile(
+        ctx, text, f'profile.{"txt" if output == "pstats" else "folded"}'
+    )
+
+
+@commands.command(name='memprofile')
+@commands.is_owner()
+async def memory_profile_command(
+    ctx: commands.Context[FormsBot], seconds: float = PROFILE_SECONDS
+) -> None:
+    if not await check_profile_seconds(ctx, seconds):
+        return
+    await ctx.send(f'Tracing allocations for {seconds} seconds...')
+    await send_profile(ctx, await profile_memory(seconds), 'memory.txt')
+
+
+async def setup(bot: FormsBot) -> None:
+    bot.add_command(query_stats_command)
+    bot.add_command(profile_command)
+    bot.add_command(memory_profile_command)
@@ -1,16 +1,100 @@
+import hmac
+
 from aiohttp import web
+from aiohttp.typedefs import Handler
+
+from .constants import PROFILE_LIMIT, PROFILE_MAX_SECONDS, PROFILE_SECONDS
+from .metrics import observe_pool, registry
+from .profiling import SORT_KEYS, profile_cpu, profile_lock, profile_memory
+from .tracing import SERVER, tracer
+
+
+@web.middleware
+async def trace_middleware(
+    request: web.Request, handler: Handler
+) -> web.StreamResponse:
+    # only the interactions endpoint starts traces, tasks it creates inherit the span
+    if not request.path.startswith('/api/'):
+        return await handler(request)
+    with tracer.span(
+        f'{request.method} {request.path}', root=True, kind=SERVER
+    ) as span:
+        response = await handler(request)
+        if span is not None:
+            span.attributes['status'] = response.status
+        return response
 
 
 async def handler(request: web.Request) -> None:
     raise web.HTTPFound('/docs/index.html')
 
 
+def check_token(request: web.Request, key: str) -> None:
+    bot = request.app.get('bot')
+    token = bot and bot.config_data.get(key)
+    # the app can be public through ngrok, so these are disabled without a token
+    if not token:
+        raise web.HTTPNotFound()
+    if not hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()
+    ):
+        raise web.HTTPUnauthorized()
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    check_token(request, 'metrics_token')
+    bot = request.app.get('bot')
+    if bot is not None and hasattr(bot, 'pool'):
+        observe_pool(bot.pool)
+    return web.Response(
+        body=registry.render().encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+    )
+
+
+def get_profile_options(request: web.Request) -> tuple[float, int]:
+    try:
+        seconds = float(request.query.get('seconds', PROFILE_SECONDS))
+        limit = int(request.query.get('limit', PROFILE_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(text='seconds and limit must be numbers')
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise web.HTTPBadRequest(
+            text=f'seconds must be between 0 and {PROFILE_MAX_SECONDS}'
+        )
+    if profile_lock.locked():
+        raise web.HTTPConflict(text='A profile is already running')
+    return seconds, limit
+
+
+async def profile_handler(request: web.Request) -> web.Response:
+    check_token(request, 'profiling_token')
+    seconds, limit = get_profile_options(request)
+    output = request.query.get('format', 'pstats')
+    if output not in ('pstats', 'collapsed'):
+        raise web.HTTPBadRequest(text='format must be pstats or collapsed')
+    sort = request.query.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        raise web.HTTPBadRequest(text=f'sort must be one of {", ".join(SORT_KEYS)}')
+    text = await profile_cpu(seconds, output=output, sort=sort, limit=limit)  # type: ignore
+    return web.Response(text=text)
+
+
+async def memory_profile_handler(request: web.Request) -> web.Response:
+    check_token(request, 'profiling_token')
+    seconds, limit = get_profile_options(request)
+    return web.Response(text=await profile_memory(seconds, limit=limit))
+
+
 def get_app() -> web.Application:
-    app = web.Application()
+    app = web.Application(middlewares=[trace_middleware])
     app.add_routes(
         [
             web.static('/docs/', './docs/_build/html/'),
             web.get('/', handler),
+            web.get('/metrics', metrics_handler),
+            web.get('/debug/profile', profile_handler),
+            web.get('/debug/memory', memory_profile_handler),
         ]
     )
     return app
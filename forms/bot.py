@@ -1,24 +1,57 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import json
+import time
 import traceback
 import sys
-from typing import TYPE_CHECKING, Any, Awaitable, Callable, TypeVar
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterator, TypeVar
 
 import aiofiles
 import aiointeractions
 import asyncpg
 import discord
+from discord import app_commands
 from discord.ext import commands
-from pyngrok import ngrok
 
 from .app import get_app
-from .constants import CONFIG_PATH
-from .database import init_db
-from .finish_form import check_database
+from .charts import ChartCache, ChartRenderer
+from .constants import (
+    CHART_CACHE_DIR_SIZE,
+    CHART_CACHE_SIZE,
+    CONFIG_PATH,
+    LOOP_LAG_THRESHOLD,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SAMPLE_RATE,
+    POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+    POOL_MAX_SIZE,
+    POOL_MIN_SIZE,
+    REPLICA_HEALTH_CHECK_INTERVAL,
+    RESPONSE_BUFFER_SIZE,
+    RESPONSE_FLUSH_INTERVAL,
+    SLOW_QUERY_THRESHOLD,
+    STATEMENT_CACHE_SIZE,
+)
+from .database import FormsConnection, init_db, prepare_statements
+from .ingest import ResponseBuffer
+from .looplag import LoopMonitor
+from .metrics import instrument_http, observe_app_command
+from .querylog import query_log
+from .router import DatabaseRouter
+from .scheduler import FormScheduler
+from .tracing import (
+    JSONLinesExporter,
+    OTLPExporter,
+    current_span,
+    trace_gateway_interactions,
+    tracer,
+)
 
 if TYPE_CHECKING:
-    from ._types import ConfigData
+    from ._types import ConfigData, Interaction
+    from .finish_form import FinishingPipeline
+    from .worker import FinishWorker
 
 
 R = TypeVar('R')
@@ -45,12 +78,24 @@ async def write_config_data(data: ConfigData) -> None:
         await f.write(dumped)
 
 
+class FormsCommandTree(app_commands.CommandTree['FormsBot']):
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        interaction.extras['started_at'] = time.perf_counter()
+        return True
+
+
 class FormsBot(commands.Bot):
     error_channel: discord.abc.Messageable
     reports_channel: discord.abc.Messageable
 
     port: int
-    pool: asyncpg.Pool
+    pool: DatabaseRouter
+    chart_renderer: ChartRenderer
+    scheduler: FormScheduler
+    response_buffer: ResponseBuffer
+    loop_monitor: LoopMonitor
+    finishing_pipeline: FinishingPipeline
+    finish_worker: FinishWorker
     config_data: ConfigData
     app_commands: dict[str, discord.app_commands.AppCommand]
 
@@ -58,6 +103,7 @@ class FormsBot(commands.Bot):
         intents = discord.Intents(guilds=True, messages=True)
         super().__init__(
             command_prefix=commands.when_mentioned,
+            tree_cls=FormsCommandTree,
             intents=intents,
             description='**Forms** is a Discord Bot that helps you easily create forms!',
             activity=discord.Activity(
@@ -71,28 +117,149 @@ class FormsBot(commands.Bot):
         )
         self.interactions_app.app['bot'] = self
         self.use_ngrok: bool = False
+        self.is_worker: bool = False
+        # set by profile_startup, skips setup that writes or posts anything
+        self.startup_profile: bool = False
+        self.startup_timings: dict[str, float] = {}
+        instrument_http(self.http)
+
+    @contextlib.contextmanager
+    def startup_phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[name] = time.perf_counter() - start
 
     async def setup_hook(self) -> None:
-        self.app_commands = {
-            command.name: command for command in await self.tree.fetch_commands()
-        }
+        self.loop_monitor = LoopMonitor(
+            threshold=self.config_data.get('loop_lag_threshold', LOOP_LAG_THRESHOLD)
+        )
+        self.loop_monitor.start()
+
+        tracer.sample_rate = self.config_data.get(
+            'trace_sample_rate', TRACE_SAMPLE_RATE
+        )
+        if path := self.config_data.get('trace_file'):
+            tracer.exporters.append(JSONLinesExporter(path))
+        if 'trace_otlp_endpoint' in self.config_data:
+            tracer.exporters.append(
+                OTLPExporter(
+                    self.config_data['trace_otlp_endpoint'] or TRACE_OTLP_ENDPOINT
+                )
+            )
+        tracer.start()
+
+        with self.startup_phase('database'):
+            query_log.threshold = self.config_data.get(
+                'slow_query_threshold', SLOW_QUERY_THRESHOLD
+            )
+            self.pool = DatabaseRouter(
+                await self.create_pool(),
+                [
+                    await self.create_pool(dsn)
+                    for dsn in self.config_data.get('replica_dsns', [])
+                ],
+                health_check_interval=self.config_data.get(
+                    'replica_health_check_interval', REPLICA_HEALTH_CHECK_INTERVAL
+                ),
+            )
+            if not self.startup_profile:
+                self.pool.start()
+                await init_db(self.pool)
+            self.response_buffer = ResponseBuffer(
+                self.pool,
+                max_size=self.config_data.get(
+                    'response_buffer_size', RESPONSE_BUFFER_SIZE
+                ),
+                interval=self.config_data.get(
+                    'response_flush_interval', RESPONSE_FLUSH_INTERVAL
+                ),
+            )
+            self.response_buffer.start()
+
+        with self.startup_phase('chart_renderer'):
+            self.chart_renderer = ChartRenderer(
+                max_workers=self.config_data.get('chart_workers'),
+                cache=ChartCache(
+                    max_size=self.config_data.get('chart_cache_size', CHART_CACHE_SIZE),
+                    directory=self.config_data.get('chart_cache_dir'),
+                    max_directory_size=self.config_data.get(
+                        'chart_cache_dir_size', CHART_CACHE_DIR_SIZE
+                    ),
+                ),
+            )
+
+        if self.is_worker:
+            await self.load_extension('forms.finish_form')
+            return
+
+        with self.startup_phase('fetch_commands'):
+            self.app_commands = {
+                command.name: command for command in await self.tree.fetch_commands()
+            }
 
         await self.load_extension('forms.commands')
         await self.load_extension('forms.errors')
         await self.load_extension('forms.finish_form')
         await self.load_extension('jishaku')
-        check_database.start(self)
+        await self.load_extension('forms.admin')
 
-        await self.set_channels()
-        await self.set_website()
+        with self.startup_phase('set_channels'):
+            await self.set_channels()
+        if not self.startup_profile:
+            with self.startup_phase('set_website'):
+                await self.set_website()
+
+    async def create_pool(self, dsn: str | None = None) -> asyncpg.Pool:
+        statement_cache_size = self.config_data.get(
+            'statement_cache_size', STATEMENT_CACHE_SIZE
+        )
+        if dsn is None:
+            connect_kwargs: dict[str, Any] = {
+                'host': self.config_data['host'],
+                'port': self.config_data['port'],
+                'user': self.config_data['user'],
+                'password': self.config_data['password'],
+                'min_size': self.config_data.get('pool_min_size', POOL_MIN_SIZE),
+            }
+        else:
+            # replicas connect lazily so one being down doesn't stop the bot starting
+            connect_kwargs = {'dsn': dsn, 'min_size': 0}
+        return await asyncpg.create_pool(
+            **connect_kwargs,
+            max_size=self.config_data.get('pool_max_size', POOL_MAX_SIZE),
+            max_inactive_connection_lifetime=self.config_data.get(
+                'pool_max_inactive_connection_lifetime',
+                POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+            ),
+            command_timeout=self.config_data.get('command_timeout'),
+            statement_cache_size=statement_cache_size,
+            connection_class=FormsConnection,
+            # named prepared statements don't survive pgbouncer's transaction mode
+            init=prepare_statements if statement_cache_size else None,
+        )
 
-        self.pool = await asyncpg.create_pool(
-            host=self.config_data['host'],
-            port=self.config_data['port'],
-            user=self.config_data['user'],
-            password=self.config_data['password'],
+    async def on_interaction(self, interaction: Interaction) -> None:
+        # the root span doesn't know what the interaction is until it's parsed
+        if (span := current_span.get()) is None:
+            return
+        data: Any = interaction.data or {}
+        span.name = f'interaction {interaction.type.name}'
+        span.attributes.update(
+            {
+                'interaction': data.get('name') or data.get('custom_id', ''),
+                'guild_id': interaction.guild_id or 0,
+                'user_id': interaction.user.id,
+            }
         )
-        await init_db(self.pool)
+
+    async def on_app_command_completion(
+        self,
+        interaction: Interaction,
+        command: app_commands.Command | app_commands.ContextMenu,
+    ) -> None:
+        observe_app_command(interaction, 'ok')
 
     @staticmethod
     async def getch(get: Callable[[int], R | None], obj_id: int) -> R:
@@ -111,27 +278,50 @@ class FormsBot(commands.Bot):
 
     async def set_website(self) -> None:
         if self.use_ngrok:
-            ngrok.set_auth_token(self.config_data['ngrok_auth_token'])
-            tunnel = ngrok.connect(self.port)
-            self.config_data['website_url'] = tunnel.public_url
+            from pyngrok import ngrok
+
+            def connect() -> str:
+                # may download ngrok and waits for the tunnel, keep it off the loop
+                ngrok.set_auth_token(self.config_data['ngrok_auth_token'])
+                return ngrok.connect(self.port).public_url
+
+            self.config_data['website_url'] = await asyncio.to_thread(connect)
         await self.error_channel.send(self.config_data['website_url'])
 
     async def load_extension(self, name: str, *, package: str | None = None) -> None:
         try:
-            await super().load_extension(name, package=package)
+            with self.startup_phase(f'extension:{name}'):
+                await super().load_extension(name, package=package)
         except commands.ExtensionError as exc:
             print(f'Failed to load extension: {name}', file=sys.stderr)
             traceback.print_exception(exc, file=sys.stderr)
 
     async def login(self, *_: Any) -> None:
         self.config_data = await get_config_data()
+        if api_base_url := self.config_data.get('api_base_url'):
+            discord.http.Route.BASE = api_base_url  # a stand-in API for load tests
         await super().login(self.config_data['token'])
 
     async def run_with_gateway(self, reconnect: bool = True) -> None:
         async with self:
             await self.login()
+            # the web app's middleware starts the traces otherwise
+            trace_gateway_interactions(self._connection)
             await self.connect(reconnect=reconnect)
 
+    async def profile_startup(self) -> dict[str, float]:
+        self.startup_profile = True
+        async with self:
+            with self.startup_phase('login'):
+                await self.login()  # runs setup_hook
+        return self.startup_timings
+
+    async def run_as_worker(self) -> None:
+        self.is_worker = True
+        async with self:
+            await self.login()  # only the HTTP API is used
+            await asyncio.Future()  # runs until cancelled
+
     async def run_with_web(self, port: int = 8080) -> None:
         async with self:
             self.port = port
@@ -140,5 +330,9 @@ class FormsBot(commands.Bot):
             )  # token is grabbed from config file
 
     async def close(self) -> None:
+        await super().close()  # unloads the extensions while the pool is open
+        await self.response_buffer.close()
+        self.chart_renderer.close()
         await self.pool.close()
-        await super().close()
+        await self.loop_monitor.close()
+        await tracer.close()
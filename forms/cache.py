@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import collections
+import time
+from typing import Callable, Generic, TypeVar
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, *, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: collections.OrderedDict[K, tuple[float, V]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: K) -> V | None:
+        try:
+            expires_at, value = self.entries[key]
+        except KeyError:
+            return None
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self.entries.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[K], bool]) -> None:
+        for key in [key for key in self.entries if predicate(key)]:
+            del self.entries[key]
+
+    def clear(self) -> None:
+        self.entries.clear()
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from typing import TYPE_CHECKING, Callable, Literal, TypeAlias
+
+import aiofiles
+import orjson
+
+from .constants import CHART_CACHE_DIR_SIZE, CHART_CACHE_SIZE, CHART_DPI, CHART_SIZE
+from .metrics import chart_render_duration
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping
+
+
+ChartKind: TypeAlias = Literal['pie', 'bar']
+
+
+def render_pie_chart(
+    name: str, responses: Mapping[str, int], *, size: tuple[float, float], dpi: int
+) -> bytes:
+    from matplotlib.figure import Figure  # only imported by the rendering processes
+
+    figure = Figure(figsize=size, dpi=dpi)
+    axes = figure.subplots()
+    axes.pie(list(responses.values()), labels=list(responses), autopct='%1.1f%%')
+    axes.set_title(name)
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def render_bar_graph(
+    name: str, responses: Mapping[str, int], *, size: tuple[float, float], dpi: int
+) -> bytes:
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=size, dpi=dpi)
+    axes = figure.subplots()
+    axes.bar(list(responses), list(responses.values()))
+    axes.set_xlabel('Options')
+    axes.set_ylabel('Count')
+    axes.set_title(name)
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+RENDERERS: dict[ChartKind, Callable[..., bytes]] = {
+    'pie': render_pie_chart,
+    'bar': render_bar_graph,
+}
+
+
+def get_chart_key(
+    kind: ChartKind,
+    name: str,
+    responses: Mapping[str, int],
+    *,
+    size: tuple[float, float],
+    dpi: int,
+) -> str:
+    payload = orjson.dumps([kind, name, sorted(responses.items()), size, dpi])
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ChartCache:
+    def __init__(
+        self,
+        *,
+        max_size: int = CHART_CACHE_SIZE,
+        directory: str | None = None,
+        max_directory_size: int = CHART_CACHE_DIR_SIZE,
+    ) -> None:
+        self.max_size = max_size
+        self.directory = directory
+        self.max_directory_size = max_directory_size
+        self.size: int = 0
+        # unknown until the directory is first scanned
+        self.directory_size: int | None = None
+        self.images: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.png')  # type: ignore
+
+    def add(self, key: str, image: bytes) -> None:
+        if key in self.images or len(image) > self.max_size:
+            return
+        self.images[key] = image
+        self.size += len(image)
+        while self.size > self.max_size:
+            _, evicted = self.images.popitem(last=False)
+            self.size -= len(evicted)
+
+    async def get(self, key: str) -> bytes | None:
+        if (image := self.images.get(key)) is not None:
+            self.images.move_to_end(key)
+            return image
+        if self.directory is None:
+            return None
+
+        try:
+            async with aiofiles.open(self.get_path(key), 'rb') as f:
+                image = await f.read()
+        except FileNotFoundError:
+            return None
+        self.add(key, image)
+        return image
+
+    def evict_files(self) -> None:
+        # runs in a thread, the directory can hold a lot of files
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.png'):
+                continue
+            with contextlib.suppress(FileNotFoundError):  # evicted by another scan
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_directory_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            size -= file_size
+        self.directory_size = size
+
+    async def set(self, key: str, image: bytes) -> None:
+        self.add(key, image)
+        if self.directory is None:
+            return
+        async with aiofiles.open(self.get_path(key), 'wb') as f:
+            await f.write(image)
+        if self.directory_size is not None:
+            self.directory_size += len(image)
+        if self.directory_size is None or self.directory_size > self.max_directory_size:
+            await asyncio.to_thread(self.evict_files)
+
+
+class ChartRenderer:
+    def __init__(
+        self,
+        *,
+        max_workers: int | None = None,
+        size: tuple[float, float] = CHART_SIZE,
+        dpi: int = CHART_DPI,
+        cache: ChartCache | None = None,
+    ) -> None:
+        self.size = size
+        self.dpi = dpi
+        self.cache = cache or ChartCache()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')
+        )
+        self.pending: dict[str, asyncio.Future[bytes]] = {}
+
+    async def render(
+        self, kind: ChartKind, name: str, responses: Mapping[str, int]
+    ) -> bytes:
+        start = time.perf_counter()
+        responses = dict(sorted(responses.items()))  # same counts, same image
+        key = get_chart_key(kind, name, responses, size=self.size, dpi=self.dpi)
+        if (image := await self.cache.get(key)) is not None:
+            chart_render_duration.observe(
+                time.perf_counter() - start, kind=kind, source='cache'
+            )
+            return image
+        if (pending := self.pending.get(key)) is not None:
+            image = await asyncio.shield(pending)
+            chart_render_duration.observe(
+                time.perf_counter() - start, kind=kind, source='pending'
+            )
+            return image
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            functools.partial(
+                RENDERERS[kind], name, responses, size=self.size, dpi=self.dpi
+            ),
+        )
+        self.pending[key] = future
+        try:
+            image = await asyncio.shield(future)
+            chart_render_duration.observe(
+                time.perf_counter() - start, kind=kind, source='render'
+            )
+            await self.cache.set(key, image)
+        finally:
+            # until the image is cached, a second request waits on this render
+            del self.pending[key]
+        return image
+
+    async def render_many(
+        self, charts: Iterable[tuple[ChartKind, str, Mapping[str, int]]]
+    ) -> list[bytes]:
+        return await asyncio.gather(
+            *(self.render(kind, name, responses) for kind, name, responses in charts)
+        )
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
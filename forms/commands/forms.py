@@ -3,6 +3,7 @@ from __future__ import annotations
 import datetime
 from typing import TYPE_CHECKING
 
+import asyncpg
 import discord
 from discord.ext import commands
 from discord import app_commands
@@ -11,10 +12,11 @@ from ..constants import COLOR
 from ..database import (
     can_take_form,
     create_form,
-    get_forms,
     get_form_data,
     get_questions,
+    search_forms,
 )
+from ..export import ExportFormat
 from ..finish_form import finish_form
 from ..views import FormModal, QuestionsView, PermissionsView
 
@@ -51,6 +53,13 @@ async def form_create_command(
         await interaction.response.send_messae(needs_permissions, ephemeral=True)
         return
 
+    form_id = f'{interaction.guild_id}{name}'
+    if await get_form_data(interaction.client.pool, form_id=form_id) is not None:
+        await interaction.response.send_message(
+            'A form with that name already exists.', ephemeral=True
+        )
+        return
+
     questions_embed = discord.Embed(
         title=name, description='**Form questions shown below**', color=COLOR
     )
@@ -76,31 +85,42 @@ async def form_create_command(
             'Data will be DMed to you. Make sure to turn on DMs!', ephemeral=True
         )
 
-    await create_form(
-        interaction.client.pool,
-        name=name,
-        form_id=f'{interaction.guild.id}{name}',
-        guild_id=interaction.guild.id,
-        response_channel_id=responses_channel and responses_channel.id,
-        creator_id=interaction.user.id,
-        finishes_at=finishes_dt,
-        questions=questions_view.items,
-        allowed_users=permissions_view.users,
-        allowed_roles=permissions_view.roles,
-        allow_everyone=permissions_view.everyone,
-    )
+    try:
+        await create_form(
+            interaction.client.pool,
+            name=name,
+            form_id=form_id,
+            guild_id=interaction.guild_id,
+            response_channel_id=responses_channel and responses_channel.id,
+            creator_id=interaction.user.id,
+            finishes_at=finishes_dt,
+            questions=questions_view.items,
+            allowed_users=permissions_view.users,
+            allowed_roles=permissions_view.roles,
+            allow_everyone=permissions_view.everyone,
+        )
+    except asyncpg.UniqueViolationError:
+        # created by someone else while the questions were being entered
+        await interaction.followup.send(
+            'A form with that name was created in the meantime. Try another name.',
+            ephemeral=True,
+        )
 
 
 @app_commands.command(name='finish', description='Finish a form early.')
 @app_commands.describe(
     form_name='The name of the form',
     send_here='Whether to send the results in this channel',
+    export_format='The file format of the results, picked by size by default',
 )
 async def form_finish_command(
-    interaction: Interaction, form_name: str, send_here: bool = False
+    interaction: Interaction,
+    form_name: str,
+    send_here: bool = False,
+    export_format: ExportFormat | None = None,
 ) -> None:
     row = await get_form_data(
-        interaction.client.pool, form_id=f'{interaction.guild.id}{form_name}'
+        interaction.client.pool, form_id=f'{interaction.guild_id}{form_name}'
     )
     try:
         creator_id = row['creator_id']
@@ -114,13 +134,18 @@ async def form_finish_command(
         await interaction.response.send_message(
             'Only the creator of the form can finish it.', ephemeral=True
         )
+        return
 
+    await interaction.response.send_message(
+        'The form is being finished.', ephemeral=True
+    )
     await finish_form(
         interaction.client,
         form_name=row['form_name'],
-        guild=interaction.guild,
+        guild=discord.Object(id=interaction.guild_id),
         creator_id=creator_id,
         channel=interaction.channel if send_here else None,
+        export_format=export_format,
     )
 
 
@@ -131,7 +156,7 @@ async def take_form_command(interaction: Interaction, form_name: str) -> None:
         if not await can_take_form(
             interaction.client.pool,
             member=interaction.user,
-            form_id=f'{interaction.guild.id}{form_name}',
+            form_id=f'{interaction.guild_id}{form_name}',
         ):
             await interaction.response.send_message(
                 'You do not have permission to take this form.', ephemeral=True
@@ -146,7 +171,7 @@ async def take_form_command(interaction: Interaction, form_name: str) -> None:
     items = [
         item
         async for _, item in get_questions(
-            interaction.client.pool, form_id=f'{interaction.guild.id}{form_name}'
+            interaction.client.pool, form_id=f'{interaction.guild_id}{form_name}'
         )
     ]
     modal = FormModal(form_name, items)
@@ -157,17 +182,10 @@ async def take_form_command(interaction: Interaction, form_name: str) -> None:
 async def form_name_autocomplete(
     interaction: Interaction, current: str
 ) -> list[app_commands.Choice[str]]:
-    current = current.lower()
-    forms = await get_forms(interaction.client.pool, guild_id=interaction.guild.id)
-    options: list[app_commands.Choice[str]] = []
-
-    for form in forms:
-        form_name = form['form_name']
-        if await can_take_form(
-            interaction.client.pool,
-            member=interaction.user,
-            form_id=f'{interaction.guild.id}{form_name}',
-        ) and form_name.lower().startswith(current):
-            options.append(app_commands.Choice(name=form_name, value=form_name))
-
-    return options
+    form_names = await search_forms(
+        interaction.client.pool, member=interaction.user, prefix=current
+    )
+    return [
+        app_commands.Choice(name=form_name, value=form_name)
+        for form_name in form_names
+    ]
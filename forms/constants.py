@@ -12,3 +12,67 @@ COLOR: Color = 0x2F3136
 ERROR_COLOR: Color = discord.Color.red()
 
 CONFIG_PATH: str = './config.json'
+
+EXPORT_BATCH_SIZE: int = 1000
+EXPORT_SPOOL_SIZE: int = 8388608
+
+CHART_SIZE: tuple[float, float] = (6.4, 4.8)
+CHART_DPI: int = 100
+CHART_CACHE_SIZE: int = 67108864
+CHART_CACHE_DIR_SIZE: int = 1073741824
+
+PERMISSIONS_CACHE_TTL: float = 60
+PERMISSIONS_CACHE_SIZE: int = 10000
+
+AUTOCOMPLETE_CACHE_TTL: float = 10
+AUTOCOMPLETE_CACHE_SIZE: int = 10000
+
+DEADLINES_CHANNEL: str = 'form_deadlines'
+SCHEDULER_MAX_SLEEP: float = 300
+
+FINISH_CONCURRENCY: int = 2
+FINISH_QUEUE_SIZE: int = 100
+FINISH_BATCH_SIZE: int = 10
+FINISH_RETRY_DELAY: float = 60
+FINISH_RETRY_MAX_DELAY: float = 3600
+
+JOBS_CHANNEL: str = 'finish_jobs'
+SCHEMA_LOCK_ID: int = 0x666F726D73  # 'forms'
+JOB_LEASE: float = 300
+JOB_MAX_ATTEMPTS: int = 5
+JOB_RETRY_DELAY: float = 60
+JOB_POLL_INTERVAL: float = 30
+JOB_SETTLE_DELAY: float = 5
+
+RESPONSES_CHANNEL_CACHE_TTL: float = 300
+RESPONSES_CHANNEL_CACHE_SIZE: int = 10000
+RESPONSE_BUFFER_SIZE: int = 500
+RESPONSE_FLUSH_INTERVAL: float = 1
+RESPONSE_BACKLOG_SIZE: int = 100000
+
+POOL_MIN_SIZE: int = 10
+POOL_MAX_SIZE: int = 10
+POOL_MAX_INACTIVE_CONNECTION_LIFETIME: float = 300
+STATEMENT_CACHE_SIZE: int = 100
+
+REPLICA_HEALTH_CHECK_INTERVAL: float = 10
+REPLICA_HEALTH_CHECK_TIMEOUT: float = 5
+REPLICA_PIN_TTL: float = 10
+REPLICA_PIN_SIZE: int = 10000
+
+SLOW_QUERY_THRESHOLD: float = 0.1
+QUERY_STATS_WINDOW: int = 1000
+QUERY_STATS_SIZE: int = 500
+
+PROFILE_SECONDS: float = 10
+PROFILE_MAX_SECONDS: float = 120
+PROFILE_SAMPLE_INTERVAL: float = 0.005
+PROFILE_LIMIT: int = 50
+
+LOOP_LAG_INTERVAL: float = 0.5
+LOOP_LAG_THRESHOLD: float = 0.25
+
+TRACE_SAMPLE_RATE: float = 0
+TRACE_EXPORT_INTERVAL: float = 5
+TRACE_QUEUE_SIZE: int = 10000
+TRACE_OTLP_ENDPOINT: str = 'http://localhost:4318/v1/traces'
@@ -1,57 +1,426 @@
 from __future__ import annotations
 
+import time
+import uuid
+
 import asyncpg
+import orjson
 import discord
-from typing import TYPE_CHECKING, AsyncGenerator, Iterable
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncContextManager,
+    AsyncGenerator,
+    Iterable,
+    NamedTuple,
+)
+
+from .cache import TTLCache
+from .constants import (
+    AUTOCOMPLETE_CACHE_SIZE,
+    AUTOCOMPLETE_CACHE_TTL,
+    DEADLINES_CHANNEL,
+    JOBS_CHANNEL,
+    PERMISSIONS_CACHE_SIZE,
+    PERMISSIONS_CACHE_TTL,
+    RESPONSES_CHANNEL_CACHE_SIZE,
+    RESPONSES_CHANNEL_CACHE_TTL,
+    SCHEMA_LOCK_ID,
+)
+from .metrics import timed
+from .querylog import get_row_count, query_log
+from .router import DatabaseRouter
 
 if TYPE_CHECKING:
     import datetime
-    from ._types import Item
+
+    from asyncpg.prepared_stmt import PreparedStatement
+
+    from ._types import Item, Pool
+
+
+class FormPermissions(NamedTuple):
+    users: frozenset[int]
+    roles: frozenset[int]
+    everyone: bool
+
+
+permissions_cache: TTLCache[str, FormPermissions] = TTLCache(
+    ttl=PERMISSIONS_CACHE_TTL, max_size=PERMISSIONS_CACHE_SIZE
+)
+
+# (guild_id, member_id, prefix) -> form names
+autocomplete_cache: TTLCache[tuple[int, int, str], list[str]] = TTLCache(
+    ttl=AUTOCOMPLETE_CACHE_TTL, max_size=AUTOCOMPLETE_CACHE_SIZE
+)
+
+# wrapped in a tuple so forms without a channel are cached too
+responses_channel_cache: TTLCache[str, tuple[int | None]] = TTLCache(
+    ttl=RESPONSES_CHANNEL_CACHE_TTL, max_size=RESPONSES_CHANNEL_CACHE_SIZE
+)
+
+
+# hot queries, prepared once per connection unless statements can't be prepared
+STATEMENTS: dict[str, str] = {
+    'get_responses_channel': '''
+        SELECT response_channel_id FROM forms WHERE form_id = $1
+    ''',
+    'get_finished': '''
+        SELECT form_name, guild_id, response_channel_id, creator_id FROM forms WHERE form_id = ANY($1) AND $2 > finishes_at
+    ''',
+    'search_forms': '''
+        SELECT f.form_name FROM forms f JOIN permissions p USING (form_id)
+        WHERE f.guild_id = $1 AND lower(f.form_name) LIKE $2
+            AND (p.everyone OR $3 = ANY(p.users) OR p.roles && $4::bigint[])
+        ORDER BY lower(f.form_name) LIMIT $5
+    ''',
+    'get_questions': '''
+        SELECT q.question_id, q.item_type, t.input_name, t.input_type, s.labels, s.descriptions, s.placeholder
+        FROM questions q
+        LEFT JOIN textinputs t USING (question_id)
+        LEFT JOIN selects s USING (question_id)
+        WHERE q.form_id = $1 ORDER BY q.question_id
+    ''',
+    'get_question_names': '''
+        SELECT q.form_id, q.question_id, q.item_type, coalesce(t.input_name, s.placeholder) AS name
+        FROM questions q
+        LEFT JOIN textinputs t USING (question_id)
+        LEFT JOIN selects s USING (question_id)
+        WHERE q.form_id = ANY($1) ORDER BY q.form_id, q.question_id
+    ''',
+    'get_select_tallies': '''
+        SELECT question_id, response, count FROM select_tallies WHERE question_id = ANY($1)
+        ORDER BY question_id, response
+    ''',
+    'get_form_data': '''
+        SELECT form_name, creator_id FROM forms WHERE form_id = $1
+    ''',
+    'get_permissions': '''
+        SELECT users, roles, everyone FROM permissions WHERE form_id = $1
+    ''',
+}
+
+
+class FormsConnection(asyncpg.Connection):
+    prepared: dict[str, PreparedStatement] | None = None
+
+    # every query is timed into query_log, which also logs the slow ones
+
+    async def execute(self, query: str, *args: Any, **kwargs: Any) -> str:
+        start = time.perf_counter()
+        status = await super().execute(query, *args, **kwargs)
+        query_log.record(query, time.perf_counter() - start, get_row_count(status))
+        return status
+
+    async def executemany(
+        self, command: str, args: Iterable[Any], **kwargs: Any
+    ) -> None:
+        args = list(args)
+        start = time.perf_counter()
+        await super().executemany(command, args, **kwargs)
+        query_log.record(command, time.perf_counter() - start, len(args))
+
+    async def fetch(self, query: str, *args: Any, **kwargs: Any) -> list[Any]:
+        start = time.perf_counter()
+        rows = await super().fetch(query, *args, **kwargs)
+        query_log.record(query, time.perf_counter() - start, len(rows))
+        return rows
+
+    async def fetchrow(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        row = await super().fetchrow(query, *args, **kwargs)
+        query_log.record(query, time.perf_counter() - start, int(row is not None))
+        return row
+
+    async def fetchval(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        value = await super().fetchval(query, *args, **kwargs)
+        query_log.record(query, time.perf_counter() - start, int(value is not None))
+        return value
+
+    async def copy_records_to_table(self, table_name: str, **kwargs: Any) -> str:
+        start = time.perf_counter()
+        status = await super().copy_records_to_table(table_name, **kwargs)
+        query_log.record(
+            f'COPY {table_name}', time.perf_counter() - start, get_row_count(status)
+        )
+        return status
+
+
+async def prepare_statements(conn: FormsConnection) -> None:
+    conn.prepared = {}
+    try:
+        for name, query in STATEMENTS.items():
+            conn.prepared[name] = await conn.prepare(query)
+    except (asyncpg.UndefinedTableError, asyncpg.UndefinedColumnError):
+        pass  # init_db has not run yet, the rest are prepared on first use
+
+
+async def get_statement(
+    conn: asyncpg.Connection, name: str
+) -> PreparedStatement | None:
+    prepared: dict[str, PreparedStatement] | None = getattr(conn, 'prepared', None)
+    if prepared is None:
+        return None
+    if (statement := prepared.get(name)) is None:
+        statement = prepared[name] = await conn.prepare(STATEMENTS[name])
+    return statement
+
+
+async def fetch(
+    conn: asyncpg.Connection, name: str, *args: Any
+) -> list[asyncpg.Record]:
+    if (statement := await get_statement(conn, name)) is None:
+        return await conn.fetch(STATEMENTS[name], *args)
+    start = time.perf_counter()
+    rows = await statement.fetch(*args)
+    query_log.record(STATEMENTS[name], time.perf_counter() - start, len(rows))
+    return rows
+
+
+async def fetchrow(
+    conn: asyncpg.Connection, name: str, *args: Any
+) -> asyncpg.Record | None:
+    if (statement := await get_statement(conn, name)) is None:
+        return await conn.fetchrow(STATEMENTS[name], *args)
+    start = time.perf_counter()
+    row = await statement.fetchrow(*args)
+    query_log.record(
+        STATEMENTS[name], time.perf_counter() - start, int(row is not None)
+    )
+    return row
+
+
+def acquire_read(
+    pool: Pool, *keys: str, primary: bool = False
+) -> AsyncContextManager[asyncpg.Connection]:
+    # replicas lag behind the primary, so recently written keys are read from it
+    if not isinstance(pool, DatabaseRouter) or primary or pool.is_pinned(keys):
+        return pool.acquire()
+    return pool.acquire_replica()
+
+
+def pin_primary(pool: Pool, *keys: str) -> None:
+    if isinstance(pool, DatabaseRouter):
+        pool.pin(*keys)
 
 
 def get_form_id(name: str, guild: discord.abc.Snowflake) -> str:
     return f'{guild.id}{name}'
 
 
-async def init_db(pool: asyncpg.Pool) -> None:
+# databases created before the tables had keys get them from migrate_keys,
+# named like the constraints CREATE TABLE gives the same columns
+PRIMARY_KEYS: dict[str, str] = {
+    'forms': 'form_id',
+    'questions': 'question_id',
+    'textinputs': 'question_id',
+    'selects': 'question_id',
+    'permissions': 'form_id',
+}
+# parents before children, so orphans are removed a level at a time
+FOREIGN_KEYS: dict[tuple[str, str], str] = {
+    ('questions', 'form_id'): 'forms',
+    ('textinputs', 'question_id'): 'questions',
+    ('selects', 'question_id'): 'questions',
+    ('responses', 'question_id'): 'questions',
+    ('permissions', 'form_id'): 'forms',
+}
+
+
+async def migrate_keys(conn: asyncpg.Connection) -> None:
+    constraints = {
+        row['conname']
+        for row in await conn.fetch(
+            '''
+            SELECT c.conname FROM pg_constraint c JOIN pg_namespace n ON n.oid = c.connamespace
+            WHERE n.nspname = current_schema()
+            '''
+        )
+    }
+    for table, column in PRIMARY_KEYS.items():
+        if f'{table}_pkey' in constraints:
+            continue
+        # keeps one arbitrary row per key, these tables have no column to order by
+        await conn.execute(f'DELETE FROM {table} WHERE {column} IS NULL')
+        await conn.execute(
+            f'''
+            DELETE FROM {table} a USING {table} b
+            WHERE a.{column} = b.{column} AND a.ctid < b.ctid
+            '''
+        )
+        await conn.execute(f'ALTER TABLE {table} ADD PRIMARY KEY ({column})')
+    for (table, column), parent in FOREIGN_KEYS.items():
+        name = f'{table}_{column}_fkey'
+        if name in constraints:
+            continue
+        # rows left behind by deletes from before the cascades existed
+        await conn.execute(
+            f'''
+            DELETE FROM {table} t
+            WHERE NOT EXISTS (SELECT 1 FROM {parent} p WHERE p.{column} = t.{column})
+            '''
+        )
+        await conn.execute(
+            f'''
+            ALTER TABLE {table} ADD CONSTRAINT {name}
+            FOREIGN KEY ({column}) REFERENCES {parent} ON DELETE CASCADE
+            '''
+        )
+
+
+@timed
+async def init_db(pool: Pool) -> None:
     conn: asyncpg.Connection
 
     async with pool.acquire() as conn:
         async with conn.transaction():
+            # processes starting together take turns, held until the commit
             await conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS forms (form_name text, form_id text, guild_id bigint, response_channel_id bigint, creator_id bigint, finishes_at timestamp with time zone)
+                SELECT pg_advisory_xact_lock($1)
+                ''',
+                SCHEMA_LOCK_ID,
+            )
+            await conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS forms (form_name text, form_id text PRIMARY KEY, guild_id bigint, response_channel_id bigint, creator_id bigint, finishes_at timestamp with time zone)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS questions (form_id text REFERENCES forms ON DELETE CASCADE, question_id text PRIMARY KEY, item_type smallint)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS textinputs (question_id text PRIMARY KEY REFERENCES questions ON DELETE CASCADE, input_name text, input_type smallint)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS selects (question_id text PRIMARY KEY REFERENCES questions ON DELETE CASCADE, labels text[], descriptions text[], placeholder text)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS responses (question_id text REFERENCES questions ON DELETE CASCADE, response_time timestamp with time zone, response text, username text, submission_id uuid)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS permissions (form_id text PRIMARY KEY REFERENCES forms ON DELETE CASCADE, users bigint[], roles bigint[], everyone bool)
                 '''
             )
+            # columns added since the tables were first created
             await conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS questions (form_id text, question_id text, item_type smallint)
+                ALTER TABLE selects ADD COLUMN IF NOT EXISTS placeholder text
                 '''
             )
             await conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS textinputs (question_id text, input_name text, input_type smallint)
+                ALTER TABLE responses ADD COLUMN IF NOT EXISTS submission_id uuid
                 '''
             )
+            # before anything that references the tables' keys
+            await migrate_keys(conn)
             await conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS selects (question_id text, labels text[], descriptions text[])
+                CREATE TABLE IF NOT EXISTS finish_jobs (form_id text PRIMARY KEY REFERENCES forms ON DELETE CASCADE, channel_id bigint, export_format text, attempts smallint NOT NULL DEFAULT 0, leased_by text, leased_until timestamp with time zone, last_error text, created_at timestamp with time zone NOT NULL DEFAULT now())
+                '''
+            )
+            backfill_tallies: bool = await conn.fetchval(
+                '''
+                SELECT to_regclass('select_tallies') IS NULL
                 '''
             )
             await conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS responses (question_id text, response_time timestamp with time zone, response text, username text)
+                CREATE TABLE IF NOT EXISTS select_tallies (question_id text REFERENCES questions ON DELETE CASCADE, response text, count bigint NOT NULL, PRIMARY KEY (question_id, response))
                 '''
             )
+            # statement level, so a buffered COPY flush is tallied in one upsert
+            # ordered so concurrent flushes lock the same rows in the same order
             await conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS permissions (form_id text, users bigint[], roles bigint[], everyone bool)
+                CREATE OR REPLACE FUNCTION tally_selects() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO select_tallies (question_id, response, count)
+                    SELECT i.question_id, i.response, count(*)
+                    FROM inserted i JOIN questions q USING (question_id)
+                    WHERE q.item_type = 1
+                    GROUP BY i.question_id, i.response
+                    ORDER BY i.question_id, i.response
+                    ON CONFLICT (question_id, response) DO UPDATE SET count = select_tallies.count + excluded.count;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+                '''
+            )
+            # creating a trigger locks responses against inserts, so only once
+            has_trigger: bool = await conn.fetchval(
+                '''
+                SELECT EXISTS (
+                    SELECT 1 FROM pg_trigger
+                    WHERE tgname = 'responses_tally_selects' AND tgrelid = 'responses'::regclass
+                )
+                '''
+            )
+            if not has_trigger:
+                await conn.execute(
+                    '''
+                    CREATE TRIGGER responses_tally_selects AFTER INSERT ON responses
+                    REFERENCING NEW TABLE AS inserted
+                    FOR EACH STATEMENT EXECUTE FUNCTION tally_selects()
+                    '''
+                )
+            if backfill_tallies:
+                # no responses can arrive between counting them and the trigger existing
+                await conn.execute(
+                    '''
+                    LOCK TABLE responses IN SHARE ROW EXCLUSIVE MODE
+                    '''
+                )
+                await conn.execute(
+                    '''
+                    INSERT INTO select_tallies (question_id, response, count)
+                    SELECT r.question_id, r.response, count(*)
+                    FROM responses r JOIN questions q USING (question_id)
+                    WHERE q.item_type = 1
+                    GROUP BY r.question_id, r.response
+                    '''
+                )
+            await conn.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS forms_guild_id_idx ON forms (guild_id)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS forms_finishes_at_idx ON forms (finishes_at)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS forms_guild_id_name_idx ON forms (guild_id, lower(form_name) text_pattern_ops)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS questions_form_id_idx ON questions (form_id, question_id)
+                '''
+            )
+            await conn.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS responses_question_id_idx ON responses (question_id)
                 '''
             )
 
 
+@timed
 async def create_form(
-    pool: asyncpg.Pool,
+    pool: Pool,
     *,
     name: str,
     form_id: str,
@@ -66,6 +435,29 @@ async def create_form(
 ) -> None:
     conn: asyncpg.Connection
 
+    question_ids: list[str] = []
+    item_types: list[int] = []
+    textinputs: list[tuple[str, str, int]] = []
+    selects: list[tuple[str, list[str], list[str | None], str | None]] = []
+    for number, question in enumerate(questions):
+        question_id = form_id + str(number)
+        if isinstance(question, discord.ui.TextInput):
+            item_types.append(0)
+            textinputs.append((question_id, question.label, int(question.style)))
+        elif isinstance(question, discord.ui.Select):
+            item_types.append(1)
+            selects.append(
+                (
+                    question_id,
+                    [option.label for option in question.options],
+                    [option.description for option in question.options],
+                    question.placeholder,
+                )
+            )
+        else:
+            continue
+        question_ids.append(question_id)
+
     async with pool.acquire() as conn:
         async with conn.transaction():
             await conn.execute(
@@ -79,37 +471,28 @@ async def create_form(
                 creator_id,
                 finishes_at,
             )
-            for number, question in enumerate(questions):
-                number = str(number)
-                if isinstance(question, discord.ui.TextInput):
-                    await conn.execute(
-                        '''
-                        INSERT INTO textinputs VALUES ($1, $2, $3)
-                        ''',
-                        form_id + number,
-                        question.label,
-                        int(question.style),
-                    )
-                    input_type = 0
-                elif isinstance(question, discord.ui.Select):
-                    await conn.execute(
-                        '''
-                        INSERT INTO selects VALUES ($1, $2, $3, $4)
-                        ''',
-                        form_id + number,
-                        [option.label for option in question.options],
-                        [option.description for option in question.options],
-                    )
-                    input_type = 1
-                else:
-                    continue
+            await conn.execute(
+                '''
+                INSERT INTO questions SELECT $1, * FROM unnest($2::text[], $3::smallint[])
+                ''',
+                form_id,
+                question_ids,
+                item_types,
+            )
+            if textinputs:
                 await conn.execute(
                     '''
-                    INSERT INTO questions VALUES ($1, $2, $3)
+                    INSERT INTO textinputs SELECT * FROM unnest($1::text[], $2::text[], $3::smallint[])
                     ''',
-                    form_id,
-                    form_id + number,
-                    input_type,
+                    *map(list, zip(*textinputs)),
+                )
+            if selects:
+                # unnest would flatten the option arrays, executemany is still pipelined
+                await conn.executemany(
+                    '''
+                    INSERT INTO selects VALUES ($1, $2, $3, $4)
+                    ''',
+                    selects,
                 )
             await conn.execute(
                 '''
@@ -120,191 +503,410 @@ async def create_form(
                 allowed_roles,
                 allow_everyone,
             )
+            await notify_deadline(conn, form_id=form_id, finishes_at=finishes_at)
+    pin_primary(pool, form_id, str(guild_id))
+    permissions_cache.pop(form_id)
+    autocomplete_cache.invalidate(lambda key: key[0] == guild_id)
 
 
-async def insert_responses(
-    pool: asyncpg.Pool,
-    *,
-    response_time: datetime.datetime,
-    user: str,
-    question_ids: Iterable[str],
-    responses: Iterable[str],
-) -> None:
+@timed
+async def write_responses(
+    pool: Pool,
+    records: list[tuple[str, datetime.datetime, str, str, uuid.UUID]],
+) -> int:
     conn: asyncpg.Connection
 
+    # one statement for the whole buffer, joined against questions since a form
+    # can be deleted while its responses are buffered
+    columns = list(zip(*records))
     async with pool.acquire() as conn:
-        data = [
-            (question_id, response_time, response, user)
-            for question_id, response in zip(question_ids, responses)
-        ]
-        await conn.executemany(
+        status = await conn.execute(
             '''
-            INSERT INTO responses VALUES ($1, $2, $3, $4)
+            INSERT INTO responses (question_id, response_time, response, username, submission_id)
+            SELECT r.question_id, r.response_time, r.response, r.username, r.submission_id
+            FROM unnest($1::text[], $2::timestamptz[], $3::text[], $4::text[], $5::uuid[])
+                AS r (question_id, response_time, response, username, submission_id)
+            JOIN questions q USING (question_id)
             ''',
-            data,
+            *columns,
         )
+    return get_row_count(status) or 0
 
 
-async def get_responses_channel(pool: asyncpg.Pool, *, form_id: str) -> int | None:
+@timed
+async def get_responses_channel(pool: Pool, *, form_id: str) -> int | None:
     conn: asyncpg.Connection
 
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            '''
-            SELECT response_channel_id FROM forms WHERE form_id = $1
-            ''',
+    if (cached := responses_channel_cache.get(form_id)) is not None:
+        return cached[0]
+
+    async with acquire_read(pool, form_id) as conn:
+        row = await fetchrow(
+            conn,
+            'get_responses_channel',
             form_id,
         )
-        return row and row['response_channel_id']
+    if row is None:
+        return None
+    responses_channel_cache.set(form_id, (row['response_channel_id'],))
+    return row['response_channel_id']
 
 
-async def get_finished(pool: asyncpg.Pool) -> list[asyncpg.Record]:
+async def notify_deadline(
+    conn: asyncpg.Connection, *, form_id: str, finishes_at: datetime.datetime | None
+) -> None:
+    payload = {
+        'form_id': form_id,
+        'finishes_at': finishes_at and finishes_at.isoformat(),
+    }
+    await conn.execute(
+        '''
+        SELECT pg_notify($1, $2)
+        ''',
+        DEADLINES_CHANNEL,
+        orjson.dumps(payload).decode(),
+    )
+
+
+@timed
+async def get_deadlines(pool: Pool) -> list[asyncpg.Record]:
     conn: asyncpg.Connection
 
+    # read from the primary so it lines up with the LISTEN connection
     async with pool.acquire() as conn:
         return await conn.fetch(
             '''
-            SELECT form_name, guild_id, response_channel_id, creator_id FROM forms WHERE $1 > finishes_at
-            ''',
-            discord.utils.utcnow(),
+            SELECT form_id, finishes_at FROM forms WHERE finishes_at IS NOT NULL ORDER BY finishes_at
+            '''
         )
 
 
-async def get_forms(
-    pool: asyncpg.Pool, *, guild_id: int | None = None
-) -> Iterable[asyncpg.Record]:
+@timed
+async def get_finished(pool: Pool, *, form_ids: list[str]) -> list[asyncpg.Record]:
     conn: asyncpg.Connection
 
-    sql = 'SELECT form_name, form_id, finishes_at FROM forms'
-    args = []
+    # read from the primary so a form that was just finished isn't finished again
+    async with pool.acquire() as conn:
+        return await fetch(
+            conn,
+            'get_finished',
+            form_ids,
+            discord.utils.utcnow(),
+        )
 
-    if guild_id:
-        sql += ' WHERE guild_id = $1'
-        args.append(guild_id)
+
+@timed
+async def enqueue_finish_job(
+    pool: Pool,
+    *,
+    form_id: str,
+    channel_id: int | None = None,
+    export_format: str | None = None,
+) -> None:
+    conn: asyncpg.Connection
 
     async with pool.acquire() as conn:
-        return await conn.fetch(sql, *args)
+        async with conn.transaction():
+            await conn.execute(
+                '''
+                INSERT INTO finish_jobs (form_id, channel_id, export_format)
+                SELECT form_id, $2, $3 FROM forms WHERE form_id = $1
+                ON CONFLICT (form_id) DO NOTHING
+                ''',
+                form_id,
+                channel_id,
+                export_format,
+            )
+            await conn.execute(
+                '''
+                SELECT pg_notify($1, $2)
+                ''',
+                JOBS_CHANNEL,
+                form_id,
+            )
 
 
-async def get_questions(
-    pool: asyncpg.Pool, *, form_id: str
-) -> AsyncGenerator[tuple[str, Item], None]:
+@timed
+async def lease_finish_jobs(
+    pool: Pool,
+    *,
+    worker_id: str,
+    lease: datetime.timedelta,
+    max_attempts: int,
+    limit: int,
+    settle_delay: datetime.timedelta,
+) -> list[asyncpg.Record]:
     conn: asyncpg.Connection
 
     async with pool.acquire() as conn:
-        questions = await conn.fetch(
+        return await conn.fetch(
             '''
-            SELECT question_id, item_type FROM questions WHERE form_id = $1 ORDER BY question_id DESC
+            WITH leased AS (
+                UPDATE finish_jobs SET leased_by = $1, leased_until = now() + $2, attempts = attempts + 1
+                WHERE form_id IN (
+                    SELECT form_id FROM finish_jobs
+                    WHERE (leased_until IS NULL OR leased_until < now()) AND attempts < $3
+                        AND created_at < now() - $5
+                    ORDER BY created_at LIMIT $4
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING form_id, channel_id, export_format, attempts
+            )
+            SELECT l.form_id, l.channel_id, l.export_format, l.attempts, f.form_name, f.guild_id, f.creator_id, f.response_channel_id
+            FROM leased l JOIN forms f USING (form_id)
             ''',
-            form_id,
+            worker_id,
+            lease,
+            max_attempts,
+            limit,
+            settle_delay,
         )
-        for question in questions:
-            if question['item_type'] == 0:
-                row = await conn.fetchrow(
-                    '''
-                    SELECT input_name, input_type FROM textinputs WHERE question_id = $1
-                    ''',
-                    question['question_id'],
-                )
-                item = discord.ui.TextInput(
-                    label=row['input_name'], style=discord.TextStyle(row['input_type'])
-                )
-            elif question['item_tyoe'] == 1:
-                row = await conn.fetchrow(
-                    '''
-                    SELECT labels, descriptions FROM selects WHERE question_id = $1
-                    ''',
-                    question['question_id'],
-                )
-                item = discord.ui.Select(
-                    options=[
-                        discord.SelectOption(label=label, description=description)
-                        for label, description in zip(
-                            row['labels'], row['descriptions']
-                        )
-                    ]
-                )
-            else:
-                continue
-            yield question['question_id'], item
 
 
-async def get_responses(
-    pool: asyncpg.Pool, *, question_id: str
-) -> list[asyncpg.Record]:
+@timed
+async def renew_finish_jobs(
+    pool: Pool,
+    *,
+    worker_id: str,
+    form_ids: list[str],
+    lease: datetime.timedelta,
+) -> None:
     conn: asyncpg.Connection
 
     async with pool.acquire() as conn:
-        return await conn.fetch(
+        await conn.execute(
             '''
-            SELECT question_id, response_time, response, username FROM responses WHERE question_id = $1
+            UPDATE finish_jobs SET leased_until = now() + $3
+            WHERE form_id = ANY($2) AND leased_by = $1
             ''',
-            question_id,
+            worker_id,
+            form_ids,
+            lease,
         )
 
 
-async def get_form_data(pool: asyncpg.Pool, *, form_id: str) -> asyncpg.Record:
+@timed
+async def fail_finish_job(
+    pool: Pool,
+    *,
+    worker_id: str,
+    form_id: str,
+    error: str,
+    retry_delay: datetime.timedelta,
+) -> None:
     conn: asyncpg.Connection
 
     async with pool.acquire() as conn:
-        return await conn.fetchrow(
+        await conn.execute(
             '''
-            SELECT form_name, creator_id FROM forms WHERE form_id = $1
+            UPDATE finish_jobs SET leased_until = now() + $3 * attempts, last_error = $4
+            WHERE form_id = $2 AND leased_by = $1
             ''',
+            worker_id,
             form_id,
+            retry_delay,
+            error,
         )
 
 
-async def get_permissions(
-    pool: asyncpg.Pool, *, form_id: str
-) -> tuple[list[int], list[int], bool]:
+@timed
+async def delete_finish_job(pool: Pool, *, worker_id: str, form_id: str) -> None:
     conn: asyncpg.Connection
 
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
+        await conn.execute(
             '''
-            SELECT users, roles, everyone FROM permissions WHERE form_id = $1
+            DELETE FROM finish_jobs WHERE form_id = $2 AND leased_by = $1
             ''',
+            worker_id,
             form_id,
         )
-        return row['users'], row['roles'], row['everyone']
 
 
-async def delete_form(pool: asyncpg.Pool, *, form_id: str) -> None:
+@timed
+async def search_forms(
+    pool: Pool, *, member: discord.Member, prefix: str, limit: int = 25
+) -> list[str]:
     conn: asyncpg.Connection
 
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            questions = await conn.fetch(
-                '''
-                SELECT question_id FROM questions WHERE form_id = $1
-                ''',
-                form_id,
+    prefix = prefix.lower()
+    key = (member.guild.id, member.id, prefix)
+    if (form_names := autocomplete_cache.get(key)) is not None:
+        return form_names
+
+    pattern = (
+        prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    )
+    async with acquire_read(pool, str(member.guild.id)) as conn:
+        rows = await fetch(
+            conn,
+            'search_forms',
+            member.guild.id,
+            pattern,
+            member.id,
+            [role.id for role in member.roles],
+            limit,
+        )
+
+    form_names = [row['form_name'] for row in rows]
+    autocomplete_cache.set(key, form_names)
+    return form_names
+
+
+@timed
+async def get_questions(
+    pool: Pool, *, form_id: str
+) -> AsyncGenerator[tuple[str, Item], None]:
+    conn: asyncpg.Connection
+
+    async with acquire_read(pool, form_id) as conn:
+        questions = await fetch(
+            conn,
+            'get_questions',
+            form_id,
+        )
+
+    for question in questions:
+        if question['item_type'] == 0:
+            item = discord.ui.TextInput(
+                label=question['input_name'],
+                style=discord.TextStyle(question['input_type']),
             )
-            await conn.executemany(
-                '''
-                DELETE FROM responses WHERE question_id = $1
-                ''',
-                [(question['question_id'],) for question in questions],
+        elif question['item_type'] == 1:
+            item = discord.ui.Select(
+                placeholder=question['placeholder'],
+                options=[
+                    discord.SelectOption(label=label, description=description)
+                    for label, description in zip(
+                        question['labels'], question['descriptions']
+                    )
+                ],
             )
-            await conn.execute(
+        else:
+            continue
+        yield question['question_id'], item
+
+
+@timed
+async def iter_submissions(
+    pool: Pool,
+    *,
+    form_ids: list[str],
+    prefetch: int = 1000,
+    primary: bool = False,
+) -> AsyncGenerator[asyncpg.Record, None]:
+    conn: asyncpg.Connection
+
+    async with acquire_read(pool, *form_ids, primary=primary) as conn:
+        async with conn.transaction():
+            async for submission in conn.cursor(
                 '''
-                DELETE FROM questions WHERE form_id = $1
+                SELECT q.form_id, r.submission_id, r.username, r.response_time,
+                    array_agg(r.question_id ORDER BY r.question_id) AS question_ids,
+                    array_agg(r.response ORDER BY r.question_id) AS responses
+                FROM questions q JOIN responses r USING (question_id)
+                WHERE q.form_id = ANY($1)
+                GROUP BY q.form_id, r.submission_id, r.response_time, r.username
+                ORDER BY q.form_id, r.response_time
                 ''',
-                form_id,
-            )
-            await conn.execute(
+                form_ids,
+                prefetch=prefetch,
+            ):
+                yield submission
+
+
+@timed
+async def get_question_names(
+    pool: Pool, *, form_ids: list[str], primary: bool = False
+) -> list[asyncpg.Record]:
+    conn: asyncpg.Connection
+
+    async with acquire_read(pool, *form_ids, primary=primary) as conn:
+        return await fetch(
+            conn,
+            'get_question_names',
+            form_ids,
+        )
+
+
+@timed
+async def get_select_tallies(
+    pool: Pool, *, question_ids: list[str], primary: bool = False
+) -> list[asyncpg.Record]:
+    conn: asyncpg.Connection
+
+    # tallies only grow, a lagging replica just returns slightly older counts
+    async with acquire_read(pool, primary=primary) as conn:
+        return await fetch(
+            conn,
+            'get_select_tallies',
+            question_ids,
+        )
+
+
+@timed
+async def get_form_data(pool: Pool, *, form_id: str) -> asyncpg.Record:
+    conn: asyncpg.Connection
+
+    async with acquire_read(pool, form_id) as conn:
+        return await fetchrow(
+            conn,
+            'get_form_data',
+            form_id,
+        )
+
+
+@timed
+async def get_permissions(
+    pool: Pool, *, form_id: str
+) -> tuple[list[int], list[int], bool]:
+    conn: asyncpg.Connection
+
+    async with acquire_read(pool, form_id) as conn:
+        row = await fetchrow(
+            conn,
+            'get_permissions',
+            form_id,
+        )
+        return row['users'], row['roles'], row['everyone']
+
+
+@timed
+async def delete_form(pool: Pool, *, form_id: str) -> None:
+    conn: asyncpg.Connection
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            guild_id = await conn.fetchval(
                 '''
-                DELETE FROM forms WHERE form_id = $1
+                DELETE FROM forms WHERE form_id = $1 RETURNING guild_id
                 ''',
                 form_id,
             )
-
-
-async def can_take_form(
-    pool: asyncpg.Pool, *, member: discord.Member, form_id: str
-) -> bool:
-    users, roles, everyone = await get_permissions(pool, form_id=form_id)
+            await notify_deadline(conn, form_id=form_id, finishes_at=None)
+    pin_primary(pool, form_id)
+    permissions_cache.pop(form_id)
+    responses_channel_cache.pop(form_id)
+    if guild_id is not None:
+        pin_primary(pool, str(guild_id))
+        autocomplete_cache.invalidate(lambda key: key[0] == guild_id)
+
+
+@timed
+async def get_form_permissions(pool: Pool, *, form_id: str) -> FormPermissions:
+    permissions = permissions_cache.get(form_id)
+    if permissions is None:
+        users, roles, everyone = await get_permissions(pool, form_id=form_id)
+        permissions = FormPermissions(frozenset(users), frozenset(roles), everyone)
+        permissions_cache.set(form_id, permissions)
+    return permissions
+
+
+@timed
+async def can_take_form(pool: Pool, *, member: discord.Member, form_id: str) -> bool:
+    users, roles, everyone = await get_form_permissions(pool, form_id=form_id)
     return (
-        member.id in users or any(role.id in roles for role in member.roles) or everyone
+        everyone
+        or member.id in users
+        or not roles.isdisjoint(role.id for role in member.roles)
     )
@@ -7,6 +7,7 @@ import discord
 from discord import app_commands
 
 from .constants import ERROR_COLOR
+from .metrics import observe_app_command
 
 if TYPE_CHECKING:
     from ._types import Interaction
@@ -16,6 +17,8 @@ if TYPE_CHECKING:
 async def error_handler(
     interaction: Interaction, error: app_commands.AppCommandError
 ) -> None:
+    observe_app_command(interaction, 'error')
+
     embed = discord.Embed(
         title='An unexpected error occurred!',
         description='It has been reported.',
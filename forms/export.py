@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import csv
+import enum
+import gzip
+import io
+import os
+import tempfile
+import time
+from typing import TYPE_CHECKING, IO, Any, AsyncIterable, ClassVar, Iterable
+
+import orjson
+
+from .constants import EXPORT_BATCH_SIZE, EXPORT_SPOOL_SIZE
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping, Sequence
+
+
+class ExportFormat(enum.Enum):
+    json = 'json'
+    ndjson = 'ndjson.gz'
+    csv = 'csv'
+
+
+class Exporter(abc.ABC):
+    extension: ClassVar[str]
+    description: ClassVar[str]
+
+    def __init__(self, questions: Mapping[str, str]) -> None:
+        self.questions = questions
+        self.file: IO[bytes] = tempfile.SpooledTemporaryFile(
+            max_size=EXPORT_SPOOL_SIZE
+        )
+        self.count: int = 0
+
+    @property
+    def filename(self) -> str:
+        return f'form.{self.extension}'
+
+    @abc.abstractmethod
+    def write(self, rows: Sequence[dict[str, Any]]) -> None:
+        ...
+
+    def finish(self) -> IO[bytes]:
+        self.file.seek(0)
+        return self.file
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JSONExporter(Exporter):
+    extension = 'json'
+    description = 'JSON data'
+
+    def write(self, rows: Sequence[dict[str, Any]]) -> None:
+        for row in rows:
+            self.file.write(b',' if self.count else b'[')
+            self.file.write(orjson.dumps(row))
+            self.count += 1
+
+    def finish(self) -> IO[bytes]:
+        self.file.write(b']' if self.count else b'[]')
+        return super().finish()
+
+
+class NDJSONExporter(Exporter):
+    extension = 'ndjson.gz'
+    description = 'gzipped JSON data with one response per line'
+
+    def __init__(self, questions: Mapping[str, str]) -> None:
+        super().__init__(questions)
+        self.gzip_file = gzip.GzipFile(fileobj=self.file, mode='wb')
+
+    def write(self, rows: Sequence[dict[str, Any]]) -> None:
+        for row in rows:
+            self.gzip_file.write(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+            self.count += 1
+
+    def finish(self) -> IO[bytes]:
+        self.gzip_file.close()  # leaves the underlying file open
+        return super().finish()
+
+
+class CSVExporter(Exporter):
+    extension = 'csv'
+    description = 'CSV data'
+
+    def __init__(self, questions: Mapping[str, str]) -> None:
+        super().__init__(questions)
+        self.columns: list[str] = list(questions.values())
+        self.write_rows([['user', 'timestamp', *self.columns]])
+
+    def write_rows(self, rows: Iterable[list[Any]]) -> None:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        self.file.write(buffer.getvalue().encode())
+
+    def write(self, rows: Sequence[dict[str, Any]]) -> None:
+        self.write_rows(
+            [
+                row['user'],
+                row['timestamp'],
+                *(row['question_responses'].get(column) for column in self.columns),
+            ]
+            for row in rows
+        )
+        self.count += len(rows)
+
+
+EXPORTERS: dict[ExportFormat, type[Exporter]] = {
+    ExportFormat.json: JSONExporter,
+    ExportFormat.ndjson: NDJSONExporter,
+    ExportFormat.csv: CSVExporter,
+}
+
+
+def get_exporters(
+    export_format: ExportFormat | None, questions: Mapping[str, str]
+) -> list[Exporter]:
+    if export_format is None:
+        # uncompressed JSON when it fits, gzipped NDJSON otherwise
+        return [JSONExporter(questions), NDJSONExporter(questions)]
+    return [EXPORTERS[export_format](questions)]
+
+
+def get_file_size(file: IO) -> int:
+    old_pos = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(old_pos, os.SEEK_SET)
+    return size
+
+
+def pick_exporter(exporters: Sequence[Exporter], limit: int) -> Exporter:
+    for exporter in exporters:
+        if get_file_size(exporter.file) <= limit:
+            break
+    else:
+        exporter = min(exporters, key=lambda exporter: get_file_size(exporter.file))
+
+    for other in exporters:
+        if other is not exporter:
+            other.close()
+    return exporter
+
+
+class FilePart(io.RawIOBase):
+    def __init__(self, file: IO[bytes], start: int, size: int) -> None:
+        self.file = file
+        self.start = start
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, min(offset, self.size))
+        return self.position
+
+    def readinto(self, buffer: Any) -> int:
+        size = min(len(buffer), self.size - self.position)
+        if size <= 0:
+            return 0
+        self.file.seek(self.start + self.position)
+        data = self.file.read(size)
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def split_file(file: IO[bytes], part_size: int) -> list[FilePart]:
+    size = get_file_size(file)
+    return [
+        FilePart(file, start, min(part_size, size - start))
+        for start in range(0, size, part_size)
+    ] or [FilePart(file, 0, 0)]
+
+
+def to_dict(
+    submission: Mapping[str, Any], questions: Mapping[str, str]
+) -> dict[str, Any]:
+    return {
+        'user': submission['username'],
+        'timestamp': submission['response_time'].timestamp(),
+        'question_responses': {
+            questions[question_id]: response
+            for question_id, response in zip(
+                submission['question_ids'], submission['responses']
+            )
+        },
+    }
+
+
+class FormExport:
+    def __init__(
+        self,
+        exporters: Sequence[Exporter],
+        *,
+        questions: Mapping[str, str],
+        selects_data: dict[str, dict[str, int]],
+    ) -> None:
+        self.exporters = exporters
+        self.questions = questions
+        self.selects_data = selects_data
+
+    def write(
+        self, submissions: Sequence[Mapping[str, Any]], timings: dict[str, float]
+    ) -> None:
+        start = time.perf_counter()
+        rows = [to_dict(submission, self.questions) for submission in submissions]
+        aggregated = time.perf_counter()
+        for exporter in self.exporters:
+            exporter.write(rows)
+        timings['aggregate'] += aggregated - start
+        timings['encode'] += time.perf_counter() - aggregated
+
+    def finish(self) -> None:
+        for exporter in self.exporters:
+            exporter.finish()
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close()
+
+
+async def export_submissions(
+    exports: Mapping[str, FormExport],
+    submissions: AsyncIterable[Mapping[str, Any]],
+    *,
+    timings: dict[str, float],
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> None:
+    # submissions are ordered by form_id, so each form's rows arrive together
+    loop = asyncio.get_running_loop()
+    form_id: str | None = None
+    batch: list[Mapping[str, Any]] = []
+
+    def finish() -> None:
+        start = time.perf_counter()
+        for export in exports.values():
+            export.finish()
+        timings['encode'] += time.perf_counter() - start
+
+    iterator = aiter(submissions)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                submission = await anext(iterator)
+            except StopAsyncIteration:
+                break
+            finally:
+                timings['fetch'] += time.perf_counter() - start
+
+            if submission['form_id'] != form_id or len(batch) >= batch_size:
+                if batch:
+                    await loop.run_in_executor(
+                        None, exports[form_id].write, batch, timings  # type: ignore
+                    )
+                form_id = submission['form_id']
+                batch = []
+            batch.append(submission)
+
+        if batch:
+            await loop.run_in_executor(
+                None, exports[form_id].write, batch, timings  # type: ignore
+            )
+        await loop.run_in_executor(None, finish)
+    except BaseException:
+        for export in exports.values():
+            export.close()
+        raise
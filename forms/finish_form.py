@@ -1,100 +1,63 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import functools
 import io
-import json
-import threading
-import os
-from typing import (
-    TYPE_CHECKING,
-    Any,
-    Awaitable,
-    Callable,
-    IO,
-    Literal,
-    Mapping,
-    ParamSpec,
-    TypeVar,
-)
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Iterator, Literal, NamedTuple
 
-import orjson
 import discord
-from discord.ext import tasks
-
-import matplotlib
-
-matplotlib.use('Agg')
 
-from matplotlib import pyplot as plt
-
-from .constants import COLOR
+from .constants import (
+    COLOR,
+    FINISH_BATCH_SIZE,
+    FINISH_CONCURRENCY,
+    FINISH_QUEUE_SIZE,
+)
 from .database import (
     delete_form,
+    enqueue_finish_job,
     get_finished,
-    get_questions,
-    get_responses,
+    get_question_names,
     get_responses_channel,
+    get_select_tallies,
     get_form_id,
+    iter_submissions,
 )
+from .export import (
+    ExportFormat,
+    Exporter,
+    FormExport,
+    export_submissions,
+    get_exporters,
+    get_file_size,
+    pick_exporter,
+    split_file,
+)
+from .metrics import export_size, finish_stage_duration, forms_finished
+from .scheduler import FormScheduler
 
 if TYPE_CHECKING:
     import asyncpg
-    from .bot import FormsBot
-
-
-P = ParamSpec('P')
-R = TypeVar('R')
-
-
-lock = threading.Lock()
-
-
-def with_lock_in_thread(func: Callable[P, R]) -> Callable[P, Awaitable[R]]:
-    @functools.wraps(func)
-    def wrapped_func(*args: P.args, **kwargs: P.args) -> Awaitable[R]:
-        with lock:
-            return asyncio.get_running_loop().run_in_executor(
-                None, functools.partial(func, *args, **kwargs)
-            )
-
-    return wrapped_func
-
-
-@with_lock_in_thread
-def create_pie_chart(name: str, responses: dict[str, int]) -> discord.File:
-    plt.pie(responses.values(), labels=responses.keys(), autopct='%1.1f%%')
-    plt.title(name)
-
-    buffer = io.BytesIO()
-    plt.savefig(buffer)
-    plt.close()
-
-    buffer.seek(0)
-    return discord.File(buffer, filename=f'{name}_pie.png')
 
+    from .bot import FormsBot
 
-@with_lock_in_thread
-def create_bar_graph(name: str, responses: dict[str, int]) -> discord.File:
-    plt.bar(responses.keys(), responses.values())
-    plt.xlabel('Count')
-    plt.ylabel('Questions')
-    plt.title(name)
 
-    buffer = io.BytesIO()
-    plt.savefig(buffer)
-    plt.close()
+_log = logging.getLogger(__name__)
 
-    buffer.seek(0)
-    return discord.File(buffer, filename=f'{name}_bar.png')
+FINISH_STAGES: tuple[str, ...] = ('fetch', 'aggregate', 'encode', 'render', 'upload')
 
 
-def get_file_size(file: IO) -> int:
-    old_pos = file.tell()
-    file.seek(0, os.SEEK_END)
-    size = file.tell()
-    file.seek(old_pos, os.SEEK_SET)
-    return size
+class FinishRequest(NamedTuple):
+    form_id: str
+    form_name: str
+    guild_id: int
+    creator_id: int
+    response_channel_id: int | None = None
+    channel: discord.abc.Messageable | None = None
+    export_format: ExportFormat | None = None
 
 
 def get_file_size_limit(premium_tier: Literal[None, 0, 1, 2, 3]) -> int:
@@ -106,6 +69,308 @@ def get_file_size_limit(premium_tier: Literal[None, 0, 1, 2, 3]) -> int:
         return 104857600
 
 
+async def send_export(
+    channel: discord.abc.Messageable, form_name: str, exporter: Exporter, limit: int
+) -> None:
+    # discord.File doesn't close a file object it didn't open
+    try:
+        if get_file_size(exporter.file) <= limit:
+            file = discord.File(exporter.file, filename=exporter.filename)
+            embed = discord.Embed(
+                title=f'{form_name} has finished!',
+                description=f'The file attached has {exporter.description} for the form.',
+                timestamp=discord.utils.utcnow(),
+                color=COLOR,
+            )
+            await channel.send(embed=embed, file=file)
+            return
+
+        parts = split_file(exporter.file, limit)
+        embed = discord.Embed(
+            title=f'{form_name} has finished!',
+            description=(
+                f'The {exporter.description} for the form is split into {len(parts)} parts. '
+                'Join the files in order to restore it.'
+            ),
+            timestamp=discord.utils.utcnow(),
+            color=COLOR,
+        )
+        await channel.send(embed=embed)
+        for number, part in enumerate(parts, start=1):
+            file = discord.File(part, filename=f'{exporter.filename}.{number:03}')
+            await channel.send(file=file)
+    finally:
+        exporter.close()
+
+
+async def render_charts(
+    bot: FormsBot, selects_data: dict[str, dict[str, int]]
+) -> list[bytes]:
+    # a select nobody answered has nothing to chart, matplotlib can't draw an empty pie
+    return await bot.chart_renderer.render_many(
+        (kind, question_name, question_responses)
+        for question_name, question_responses in selects_data.items()
+        if question_responses
+        for kind in ('pie', 'bar')
+    )
+
+
+async def send_charts(
+    channel: discord.abc.Messageable,
+    selects_data: dict[str, dict[str, int]],
+    images: list[bytes],
+) -> None:
+    charts = iter(images)
+    for question_name, question_responses in selects_data.items():
+        if not question_responses:
+            embed = discord.Embed(
+                title=question_name,
+                description='Nobody answered this question.',
+                color=COLOR,
+            )
+            await channel.send(embed=embed)
+            continue
+
+        pie_file = discord.File(
+            io.BytesIO(next(charts)), filename=f'{question_name}_pie.png'
+        )
+        bar_file = discord.File(
+            io.BytesIO(next(charts)), filename=f'{question_name}_bar.png'
+        )
+
+        pie_embed = discord.Embed(title=question_name, color=COLOR)
+        pie_embed.set_image(url=f'attachment://{pie_file.filename}')
+        bar_embed = discord.Embed(title=question_name, color=COLOR)
+        bar_embed.set_image(url=f'attachment://{bar_file.filename}')
+        await channel.send(embeds=[pie_embed, bar_embed], files=[pie_file, bar_file])
+
+
+@contextlib.contextmanager
+def measure(timings: dict[str, float], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] += time.perf_counter() - start
+
+
+class FinishingPipeline:
+    def __init__(
+        self,
+        bot: FormsBot,
+        *,
+        concurrency: int = FINISH_CONCURRENCY,
+        queue_size: int = FINISH_QUEUE_SIZE,
+        batch_size: int = FINISH_BATCH_SIZE,
+    ) -> None:
+        self.bot = bot
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue[FinishRequest] = asyncio.Queue(queue_size)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending: set[str] = set()
+        self.workers: list[asyncio.Task[None]] = []
+        self.timings: dict[str, float] = dict.fromkeys(FINISH_STAGES, 0.0)
+        # called with the submitted forms that are still open after a batch
+        self.on_unfinished: Callable[[list[str]], None] | None = None
+
+    def start(self) -> None:
+        self.workers = [
+            asyncio.create_task(self.worker()) for _ in range(self.concurrency)
+        ]
+
+    async def close(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self, request: FinishRequest) -> None:
+        # waits while the queue is full
+        if request.form_id in self.pending:
+            return
+        self.pending.add(request.form_id)
+        await self.queue.put(request)
+
+    async def finish(self, request: FinishRequest) -> None:
+        if request.form_id in self.pending:
+            return
+        self.pending.add(request.form_id)
+        try:
+            await self.run([request])
+        finally:
+            self.pending.discard(request.form_id)
+
+    async def worker(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            finished: list[str] = []
+            try:
+                finished = await self.run(batch)
+            except Exception:
+                _log.exception(
+                    'Failed to finish forms %s', [request.form_id for request in batch]
+                )
+            finally:
+                for request in batch:
+                    self.pending.discard(request.form_id)
+                    self.queue.task_done()
+            unfinished = [
+                request.form_id for request in batch if request.form_id not in finished
+            ]
+            if unfinished and self.on_unfinished is not None:
+                self.on_unfinished(unfinished)
+
+    async def get_channel(
+        self, request: FinishRequest
+    ) -> discord.abc.Messageable | None:
+        if request.channel is not None:
+            return request.channel
+        try:
+            if request.response_channel_id is None:
+                return await self.bot.getch(self.bot.get_user, request.creator_id)
+            return await self.bot.getch(
+                self.bot.get_channel, request.response_channel_id
+            )
+        except discord.HTTPException:
+            return None
+
+    async def render_charts(
+        self, form_id: str, export: FormExport
+    ) -> list[bytes] | None:
+        # one form's charts failing to render shouldn't hold back the rest of the batch
+        try:
+            return await render_charts(self.bot, export.selects_data)
+        except Exception:
+            _log.exception('Failed to render the charts of %s', form_id)
+            return None
+
+    async def run(self, requests: list[FinishRequest]) -> list[str]:
+        async with self.semaphore:
+            timings = dict.fromkeys(FINISH_STAGES, 0.0)
+            finished = await self.finish_batch(requests, timings)
+            for form_id in finished:
+                await delete_form(self.bot.pool, form_id=form_id)
+
+        for stage, seconds in timings.items():
+            self.timings[stage] += seconds
+            finish_stage_duration.observe(seconds, stage=stage)
+        forms_finished.inc(len(finished))
+        _log.info(
+            'Finished %s/%s forms (%s)',
+            len(finished),
+            len(requests),
+            ', '.join(f'{stage}={seconds:.3f}s' for stage, seconds in timings.items()),
+        )
+        return finished
+
+    async def finish_batch(
+        self, requests: list[FinishRequest], timings: dict[str, float]
+    ) -> list[str]:
+        with measure(timings, 'fetch'):
+            await self.bot.response_buffer.flush()
+            channels = await asyncio.gather(*map(self.get_channel, requests))
+            # the flushed responses may not have reached the replicas yet
+            question_rows: list[asyncpg.Record] = await get_question_names(
+                self.bot.pool,
+                form_ids=[request.form_id for request in requests],
+                primary=True,
+            )
+            tally_rows: list[asyncpg.Record] = await get_select_tallies(
+                self.bot.pool,
+                question_ids=[
+                    row['question_id'] for row in question_rows if row['item_type'] == 1
+                ],
+                primary=True,
+            )
+        tallies: dict[str, dict[str, int]] = {}
+        for row in tally_rows:
+            tallies.setdefault(row['question_id'], {})[row['response']] = row['count']
+
+        exports: dict[str, FormExport] = {}
+        try:
+            for request, channel in zip(requests, channels):
+                if channel is None:
+                    continue
+                questions: dict[str, str] = {}
+                selects_data: dict[str, dict[str, int]] = {}
+                for row in question_rows:
+                    if row['form_id'] != request.form_id:
+                        continue
+                    questions[row['question_id']] = row['name']
+                    if row['item_type'] == 1:
+                        selects_data[row['name']] = tallies.get(row['question_id'], {})
+                exports[request.form_id] = FormExport(
+                    get_exporters(request.export_format, questions),
+                    questions=questions,
+                    selects_data=selects_data,
+                )
+
+            if exports:
+                await export_submissions(
+                    exports,
+                    iter_submissions(
+                        self.bot.pool, form_ids=list(exports), primary=True
+                    ),
+                    timings=timings,
+                )
+
+            with measure(timings, 'render'):
+                images = await asyncio.gather(
+                    *(
+                        self.render_charts(form_id, export)
+                        for form_id, export in exports.items()
+                    )
+                )
+            charts_by_form = dict(zip(exports, images))
+
+            finished: list[str] = []
+            with measure(timings, 'upload'):
+                for request, channel in zip(requests, channels):
+                    if channel is None:
+                        finished.append(request.form_id)
+                        continue
+                    if (charts := charts_by_form[request.form_id]) is None:
+                        continue
+                    # a closed DM or deleted channel only fails its own form
+                    try:
+                        await self.upload(
+                            request, channel, exports[request.form_id], charts
+                        )
+                    except Exception:
+                        _log.exception(
+                            'Failed to send the results of %s', request.form_id
+                        )
+                    else:
+                        finished.append(request.form_id)
+            return finished
+        finally:
+            # the spooled files may have rolled over to disk
+            for export in exports.values():
+                export.close()
+
+    async def upload(
+        self,
+        request: FinishRequest,
+        channel: discord.abc.Messageable,
+        export: FormExport,
+        charts: list[bytes],
+    ) -> None:
+        limit = get_file_size_limit(
+            channel.guild.premium_tier
+            if isinstance(channel, discord.abc.GuildChannel)
+            else None
+        )
+        exporter = pick_exporter(export.exporters, limit)
+        export_size.observe(get_file_size(exporter.file), format=exporter.extension)
+        await send_export(channel, request.form_name, exporter, limit)
+        if export.selects_data:
+            async with channel.typing():
+                await send_charts(channel, export.selects_data, charts)
+
+
 async def finish_form(
     bot: FormsBot,
     *,
@@ -113,102 +378,94 @@ async def finish_form(
     form_name: str,
     creator_id: int,
     channel: discord.abc.Messageable | None = None,
+    export_format: ExportFormat | None = None,
 ) -> None:
     form_id = get_form_id(form_name, guild)
-    responses: dict[int, list[asyncpg.Record]] = {}
-    questions: dict[str, str] = {}
-    selects_data: dict[str, dict[str, int]] = {}
-
-    async for question_id, question in get_questions(bot.pool, form_id=form_id):
-        if isinstance(question, discord.ui.TextInput):
-            questions[question_id] = question.label
-        elif isinstance(question, discord.ui.Select):
-            questions[question_id] = question.placeholder
-            selects_data[question.placeholder] = {}
-        for response in await get_responses(bot.pool, question_id=question_id):
-            timestamp = response['response_time'].timestamp()
-            responses.setdefault(timestamp, [])
-            responses[timestamp].append(response)
-
-    data = []
-    for timestamp, rows in responses.items():
-        full_form_response = {}
-        row: Mapping[str, Any] = {}
-        for row in rows:
-            question_name = questions[row['question_id']]
-            full_form_response[question_name] = row['response']
-            if question_name in selects_data:
-                selects_data[question_name].setdefault(row['response'], 0)
-                selects_data[question_name][row['response']] += 1
-
-        data.append(
-            {
-                'user': row['username'],  # all rows have the same username,
-                'timestamp': timestamp,
-                'question_responses': full_form_response,
-            }
+    if bot.config_data.get('finish_in_worker'):
+        # the worker can only flush its own buffer
+        await bot.response_buffer.flush()
+        await enqueue_finish_job(
+            bot.pool,
+            form_id=form_id,
+            channel_id=channel and channel.id,  # type: ignore
+            export_format=export_format and export_format.value,
         )
+        return
 
-    response_channel_id = await get_responses_channel(bot.pool, form_id=form_id)
+    response_channel_id = None
     if channel is None:
-        try:
-            if response_channel_id is None:
-                channel = await bot.getch(bot.get_user, creator_id)
-            else:
-                channel = await bot.getch(bot.get_channel, response_channel_id)
-        except discord.HTTPException:
-            pass
-        else:
-            buffer = io.BytesIO(json.dumps(data).encode())
-            if get_file_size(buffer) > get_file_size_limit(
-                channel.guild.premium_tier
-                if isinstance(channel, discord.abc.GuildChannel)
-                else None
-            ):
-                buffer.close()
-                buffer = io.BytesIO(orjson.dumps(data))  # orjson takes up less space
-
-            file = discord.File(buffer, filename='form.json')
-            embed = discord.Embed(
-                title=f'{form_name} has finished!',
-                description='The file attached has JSON data for the form.',
-                timestamp=discord.utils.utcnow(),
-                color=COLOR,
-            )
-            await channel.send(embed=embed, file=file)
-
-            async with channel.typing():
-                for question_name, question_responses in selects_data:
-                    pie_file = await create_pie_chart(question_name, question_responses)
-                    bar_file = await create_bar_graph(question_name, question_responses)
-
-                    pie_embed = discord.Embed(title=question_name, color=COLOR)
-                    pie_embed.set_image(url=f'attachment://{pie_file.filename}')
-                    bar_embed = discord.Embed(title=question_name, color=COLOR)
-                    bar_embed.set_image(url=f'attachment://{bar_file.filename}')
-                    await channel.send(
-                        embeds=[pie_embed, bar_embed], files=[pie_file, bar_file]
-                    )
-    await delete_form(bot.pool, form_id=form_id)
+        response_channel_id = await get_responses_channel(bot.pool, form_id=form_id)
+
+    await bot.finishing_pipeline.finish(
+        FinishRequest(
+            form_id=form_id,
+            form_name=form_name,
+            guild_id=guild.id,
+            creator_id=creator_id,
+            response_channel_id=response_channel_id,
+            channel=channel,
+            export_format=export_format,
+        )
+    )
 
 
-@tasks.loop(minutes=20)
-async def check_database(bot: FormsBot) -> None:
+async def finish_due_forms(bot: FormsBot, form_ids: list[str]) -> None:
     await bot.wait_until_ready()
-    for form in await get_finished(bot.pool):
-        bot.loop.create_task(
-            finish_form(
-                bot,
-                guild=discord.Object(id=form['guild_id']),
+    for form in await get_finished(bot.pool, form_ids=form_ids):
+        await bot.finishing_pipeline.submit(
+            FinishRequest(
+                form_id=get_form_id(
+                    form['form_name'], discord.Object(id=form['guild_id'])
+                ),
                 form_name=form['form_name'],
+                guild_id=form['guild_id'],
                 creator_id=form['creator_id'],
+                response_channel_id=form['response_channel_id'],
             )
         )
 
 
+async def enqueue_due_forms(bot: FormsBot, form_ids: list[str]) -> None:
+    for form_id in form_ids:
+        await enqueue_finish_job(bot.pool, form_id=form_id)
+
+
 async def setup(bot: FormsBot) -> None:
-    check_database.start(bot)
+    if bot.config_data.get('finish_in_worker') and not bot.is_worker:
+        return  # forms are finished by `python -m forms worker`
+    if bot.startup_profile:
+        return  # the scheduler would start finishing due forms
+
+    bot.finishing_pipeline = FinishingPipeline(
+        bot,
+        concurrency=bot.config_data.get('finish_concurrency', FINISH_CONCURRENCY),
+        queue_size=bot.config_data.get('finish_queue_size', FINISH_QUEUE_SIZE),
+        batch_size=bot.config_data.get('finish_batch_size', FINISH_BATCH_SIZE),
+    )
+    bot.finishing_pipeline.start()
+
+    if bot.is_worker:
+        from .worker import FinishWorker
+
+        bot.finish_worker = FinishWorker(bot)
+        await bot.finish_worker.start()
+        on_due = functools.partial(enqueue_due_forms, bot)
+    else:
+        on_due = functools.partial(finish_due_forms, bot)
+    bot.scheduler = FormScheduler(bot.pool, on_due)
+    if not bot.is_worker:
+        # the worker's jobs are retried through the finish_jobs queue instead
+        bot.finishing_pipeline.on_unfinished = bot.scheduler.retry
+    await bot.scheduler.start()
 
 
 async def teardown(bot: FormsBot) -> None:
-    check_database.cancel()
+    if bot.config_data.get('finish_in_worker') and not bot.is_worker:
+        return
+    if bot.startup_profile:
+        return
+
+    await bot.scheduler.close()
+    if bot.is_worker:
+        await bot.finish_worker.close()
+    await bot.finishing_pipeline.close()
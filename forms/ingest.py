@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from typing import TYPE_CHECKING, Iterable
+
+from .constants import (
+    RESPONSE_BACKLOG_SIZE,
+    RESPONSE_BUFFER_SIZE,
+    RESPONSE_FLUSH_INTERVAL,
+)
+from .database import write_responses
+from .router import CONNECTION_ERRORS
+
+if TYPE_CHECKING:
+    import datetime
+
+    from ._types import Pool
+
+
+_log = logging.getLogger(__name__)
+
+
+class ResponseBuffer:
+    def __init__(
+        self,
+        pool: Pool,
+        *,
+        max_size: int = RESPONSE_BUFFER_SIZE,
+        interval: float = RESPONSE_FLUSH_INTERVAL,
+        max_backlog: int = RESPONSE_BACKLOG_SIZE,
+    ) -> None:
+        self.pool = pool
+        self.max_size = max_size
+        self.interval = interval
+        self.max_backlog = max_backlog
+        self.records: list[tuple[str, datetime.datetime, str, str, uuid.UUID]] = []
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task[None] | None = None
+        self.flushes: set[asyncio.Task[None]] = set()
+
+    def add(
+        self,
+        *,
+        response_time: datetime.datetime,
+        user: str,
+        question_ids: Iterable[str],
+        responses: Iterable[str],
+    ) -> None:
+        submission_id = uuid.uuid4()
+        self.records.extend(
+            (question_id, response_time, response, user, submission_id)
+            for question_id, response in zip(question_ids, responses)
+        )
+        # one flush at a time, so an outage doesn't pile up a task per submission
+        if len(self.records) >= self.max_size and not self.flushes:
+            task = asyncio.create_task(self.flush())
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def flush(self) -> None:
+        async with self.lock:
+            records, self.records = self.records, []
+            if records:
+                await self.write(records)
+
+    async def write(
+        self, records: list[tuple[str, datetime.datetime, str, str, uuid.UUID]]
+    ) -> None:
+        try:
+            written = await write_responses(self.pool, records)
+        except CONNECTION_ERRORS:
+            _log.exception('Failed to write %s responses', len(records))
+            self.retry(records)
+            return
+        except Exception:
+            if len(records) == 1:
+                _log.exception('Dropping a response that could not be written')
+                return
+            # a bad record would fail every flush, so split until it's found
+            middle = len(records) // 2
+            await self.write(records[:middle])
+            await self.write(records[middle:])
+            return
+        if written < len(records):
+            _log.warning(
+                'Dropped %s responses to forms deleted before they were written',
+                len(records) - written,
+            )
+
+    def retry(
+        self, records: list[tuple[str, datetime.datetime, str, str, uuid.UUID]]
+    ) -> None:
+        self.records[:0] = records  # written on the next flush
+        if (excess := len(self.records) - self.max_backlog) > 0:
+            _log.error('Dropping the %s oldest responses, the backlog is full', excess)
+            del self.records[:excess]
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await asyncio.gather(*self.flushes, return_exceptions=True)
+        await self.flush()
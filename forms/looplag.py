@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from .constants import LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD
+from .metrics import event_loop_blocked, event_loop_lag
+
+
+_log = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        *,
+        interval: float = LOOP_LAG_INTERVAL,
+        threshold: float = LOOP_LAG_THRESHOLD,
+    ) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.thread_id: int | None = None
+        self.task: asyncio.Task[None] | None = None
+        self.stopped = threading.Event()
+        self.watchdog: threading.Thread | None = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            event_loop_lag.observe(max(loop.time() - start - self.interval, 0))
+
+    def watch(self) -> None:
+        # runs in its own thread so it can see the loop while it's blocked
+        reported = None
+        while not self.stopped.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat  # once per stall
+            event_loop_blocked.inc()
+            frame = sys._current_frames().get(self.thread_id)  # type: ignore
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            _log.warning(
+                'Event loop has been blocked for %.0fms:\n%s', blocked * 1000, stack
+            )
+
+    def start(self) -> None:
+        self.thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.create_task(self.run())
+        self.stopped.clear()
+        self.watchdog = threading.Thread(
+            target=self.watch, name='loop-watchdog', daemon=True
+        )
+        self.watchdog.start()
+
+    async def close(self) -> None:
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        if self.watchdog is not None:
+            await asyncio.to_thread(self.watchdog.join)
+            self.watchdog = None
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import abc
+import contextlib
+import functools
+import inspect
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, TypeVar
+
+from .querylog import current_function
+from .tracing import CLIENT, current_span, tracer
+
+if TYPE_CHECKING:
+    from discord.http import HTTPClient, Route
+
+    from ._types import Interaction, Pool
+
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+SIZE_BUCKETS: tuple[float, ...] = tuple(1024.0 * 4**power for power in range(10))
+
+
+def format_labels(labelnames: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not labelnames:
+        return ''
+    escaped = (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in values
+    )
+    return (
+        '{'
+        + ','.join(f'{name}="{value}"' for name, value in zip(labelnames, escaped))
+        + '}'
+    )
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    kind: str
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def get_key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            *self.samples(),
+        ]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.get_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self.values.items():
+            labels = format_labels(self.labelnames, key)
+            yield f'{self.name}{labels} {format_value(value)}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self.get_key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        *,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = (*buckets, float('inf'))
+        # per label set: a count per bucket (not cumulative), then the sum
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.get_key(labels)
+        if (entry := self.values.get(key)) is None:
+            entry = self.values[key] = ([0] * len(self.buckets), [0.0])
+        counts, total = entry
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    (*self.labelnames, 'le'), (*key, format_value(bound))
+                )
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {format_value(total[0])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Any:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+registry = Registry()
+
+app_command_duration: Histogram = registry.register(
+    Histogram(
+        'forms_app_command_duration_seconds',
+        'Time taken to run each app command.',
+        ('command', 'status'),
+    )
+)
+database_duration: Histogram = registry.register(
+    Histogram(
+        'forms_database_duration_seconds',
+        'Time taken by each database function.',
+        ('function', 'status'),
+    )
+)
+pool_acquire_duration: Histogram = registry.register(
+    Histogram(
+        'forms_pool_acquire_duration_seconds',
+        'Time spent waiting for a pooled connection.',
+        ('pool',),
+    )
+)
+pool_connections: Gauge = registry.register(
+    Gauge(
+        'forms_pool_connections',
+        'Pooled connections by state.',
+        ('pool', 'state'),
+    )
+)
+finish_stage_duration: Histogram = registry.register(
+    Histogram(
+        'forms_finish_stage_duration_seconds',
+        'Time spent in each stage of finishing a batch of forms.',
+        ('stage',),
+    )
+)
+forms_finished: Counter = registry.register(
+    Counter('forms_finished_total', 'Forms finished and deleted.')
+)
+chart_render_duration: Histogram = registry.register(
+    Histogram(
+        'forms_chart_render_duration_seconds',
+        'Time taken to render a chart, by where it came from.',
+        ('kind', 'source'),
+    )
+)
+export_size: Histogram = registry.register(
+    Histogram(
+        'forms_export_size_bytes',
+        'Size of the exported file sent for each finished form.',
+        ('format',),
+        buckets=SIZE_BUCKETS,
+    )
+)
+discord_http_duration: Histogram = registry.register(
+    Histogram(
+        'forms_discord_http_duration_seconds',
+        'Latency of requests to the Discord API.',
+        ('method', 'route', 'status'),
+    )
+)
+event_loop_lag: Histogram = registry.register(
+    Histogram(
+        'forms_event_loop_lag_seconds',
+        'How late the event loop ran a timer scheduled on it.',
+    )
+)
+event_loop_blocked: Counter = registry.register(
+    Counter(
+        'forms_event_loop_blocked_total',
+        'Times a callback held the event loop past the lag threshold.',
+    )
+)
+
+
+def timed(function: F) -> F:
+    # async generators are timed until they are exhausted or closed
+    name = function.__name__
+    labels = {'function': name}
+
+    if inspect.isasyncgenfunction(function):
+
+        @functools.wraps(function)
+        async def generator_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            status = 'error'
+            generator = function(*args, **kwargs)
+            span = tracer.start_span(name)
+            error: BaseException | None = None
+            try:
+                while True:
+                    # only while the generator runs, the caller runs in between
+                    token = current_function.set(name)
+                    span_token = current_span.set(span) if span else None
+                    try:
+                        item = await anext(generator)
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        current_function.reset(token)
+                        if span_token is not None:
+                            current_span.reset(span_token)
+                    yield item
+                status = 'ok'
+            except GeneratorExit:
+                status = 'ok'  # the caller stopped early
+                raise
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                await generator.aclose()
+                database_duration.observe(
+                    time.perf_counter() - start, status=status, **labels
+                )
+                if span is not None:
+                    tracer.end_span(span, error)
+
+        return generator_wrapper  # type: ignore
+
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        status = 'error'
+        token = current_function.set(name)
+        try:
+            with tracer.span(name):
+                result = await function(*args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            current_function.reset(token)
+            database_duration.observe(
+                time.perf_counter() - start, status=status, **labels
+            )
+
+    return wrapper  # type: ignore
+
+
+def observe_app_command(interaction: Interaction, status: str) -> None:
+    start: float | None = interaction.extras.get('started_at')
+    if start is None or interaction.command is None:
+        return
+    app_command_duration.observe(
+        time.perf_counter() - start,
+        command=interaction.command.qualified_name,
+        status=status,
+    )
+
+
+def observe_pool(pool: Pool) -> None:
+    pools = {'primary': getattr(pool, 'primary', pool)}
+    for number, replica in enumerate(getattr(pool, 'replicas', ())):
+        pools[f'replica{number}'] = replica
+    for name, item in pools.items():
+        idle = item.get_idle_size()
+        pool_connections.set(item.get_size() - idle, pool=name, state='in_use')
+        pool_connections.set(idle, pool=name, state='idle')
+
+
+def instrument_http(http: HTTPClient) -> None:
+    request = http.request
+
+    async def timed_request(route: Route, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        status = 'error'
+        span = tracer.start_span(
+            f'{route.method} {route.path}', kind=CLIENT, route=route.path
+        )
+        error: BaseException | None = None
+        try:
+            result = await request(route, **kwargs)
+            status = 'ok'
+            return result
+        except Exception as exc:
+            status = str(getattr(exc, 'status', 'error'))
+            error = exc
+            raise
+        finally:
+            discord_http_duration.observe(
+                time.perf_counter() - start,
+                method=route.method,
+                route=route.path,
+                status=status,
+            )
+            if span is not None:
+                span.attributes['status'] = status
+                tracer.end_span(span, error)
+
+    http.request = timed_request  # type: ignore
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import collections
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Literal
+
+from .constants import PROFILE_LIMIT, PROFILE_SAMPLE_INTERVAL
+
+ProfileFormat = Literal['pstats', 'collapsed']
+SORT_KEYS = frozenset(key.value for key in pstats.SortKey)
+
+# cProfile and tracemalloc are process wide, so one profile runs at a time
+profile_lock = asyncio.Lock()
+
+
+def get_frame_name(frame: object) -> str:
+    code = frame.f_code  # type: ignore
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: collections.Counter[str] = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: list[str] = []
+            while frame is not None:
+                stack.append(get_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self) -> str:
+        # the format flamegraph.pl and speedscope read
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in self.counts.most_common()
+        )
+
+
+async def profile_cpu(
+    seconds: float,
+    *,
+    output: ProfileFormat = 'pstats',
+    sort: str = 'cumulative',
+    limit: int = PROFILE_LIMIT,
+) -> str:
+    async with profile_lock:
+        if output == 'collapsed':
+            # samples whatever the event loop's thread is running
+            sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+            return sampler.collapsed()
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+async def profile_memory(seconds: float, *, limit: int = PROFILE_LIMIT) -> str:
+    async with profile_lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(25)
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+    stats = after.compare_to(before, 'traceback')
+    lines = [f'Top {limit} allocation differences over {seconds}s']
+    for stat in stats[:limit]:
+        lines.append('')
+        lines.append(str(stat))
+        lines.extend(stat.traceback.format(limit=10))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import collections
+import contextvars
+import functools
+import logging
+import math
+import re
+from typing import NamedTuple
+
+from .constants import QUERY_STATS_SIZE, QUERY_STATS_WINDOW, SLOW_QUERY_THRESHOLD
+from .tracing import tracer
+
+
+_log = logging.getLogger(__name__)
+
+# the database.py function running the query, set by metrics.timed
+current_function: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    'current_function', default=None
+)
+
+WHITESPACE = re.compile(r'\s+')
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![$\w])\d+(?:\.\d+)?\b")
+ROW_COUNT = re.compile(r'(\d+)$')
+
+
+@functools.lru_cache(maxsize=QUERY_STATS_SIZE)
+def normalize(query: str) -> str:
+    # parameters are already $n, so only inline literals need replacing
+    return LITERALS.sub('?', WHITESPACE.sub(' ', query).strip())
+
+
+def get_row_count(status: str) -> int | None:
+    match = ROW_COUNT.search(status)
+    return match and int(match.group(1))
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    # nearest rank, values must be sorted
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class QueryStats(NamedTuple):
+    query: str
+    count: int
+    total: float
+    p50: float
+    p95: float
+    p99: float
+
+
+class QueryLog:
+    def __init__(
+        self,
+        *,
+        threshold: float = SLOW_QUERY_THRESHOLD,
+        window: int = QUERY_STATS_WINDOW,
+        max_size: int = QUERY_STATS_SIZE,
+    ) -> None:
+        self.threshold = threshold
+        self.window = window
+        self.max_size = max_size
+        # normalized query -> the last `window` durations
+        self.durations: collections.OrderedDict[
+            str, collections.deque[float]
+        ] = collections.OrderedDict()
+        self.counts: dict[str, int] = {}
+        self.totals: dict[str, float] = {}
+
+    def record(self, query: str, duration: float, rows: int | None = None) -> None:
+        query = normalize(query)
+        if (durations := self.durations.get(query)) is None:
+            durations = self.durations[query] = collections.deque(maxlen=self.window)
+            while len(self.durations) > self.max_size:
+                evicted, _ = self.durations.popitem(last=False)
+                del self.counts[evicted], self.totals[evicted]
+        durations.append(duration)
+        self.counts[query] = self.counts.get(query, 0) + 1
+        self.totals[query] = self.totals.get(query, 0.0) + duration
+        if rows is None:
+            tracer.add_span(query.split(' ', 1)[0], duration, statement=query)
+        else:
+            tracer.add_span(
+                query.split(' ', 1)[0], duration, statement=query, rows=rows
+            )
+
+        if duration >= self.threshold:
+            _log.warning(
+                'Slow query in %s took %.1fms (%s rows): %s',
+                current_function.get() or 'unknown',
+                duration * 1000,
+                'unknown' if rows is None else rows,
+                query,
+            )
+
+    def stats(self) -> list[QueryStats]:
+        stats: list[QueryStats] = []
+        for query, durations in self.durations.items():
+            values = sorted(durations)
+            stats.append(
+                QueryStats(
+                    query,
+                    self.counts[query],
+                    self.totals[query],
+                    percentile(values, 0.5),
+                    percentile(values, 0.95),
+                    percentile(values, 0.99),
+                )
+            )
+        stats.sort(key=lambda stat: stat.total, reverse=True)
+        return stats
+
+    def clear(self) -> None:
+        self.durations.clear()
+        self.counts.clear()
+        self.totals.clear()
+
+
+query_log = QueryLog()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+from typing import Any, AsyncIterator, Generator, Iterable
+
+import asyncpg
+
+from .cache import TTLCache
+from .constants import (
+    REPLICA_HEALTH_CHECK_INTERVAL,
+    REPLICA_HEALTH_CHECK_TIMEOUT,
+    REPLICA_PIN_SIZE,
+    REPLICA_PIN_TTL,
+)
+from .metrics import pool_acquire_duration
+from .querylog import query_log
+
+
+_log = logging.getLogger(__name__)
+
+# errors that mean the replica itself is unreachable, not that the query was bad
+CONNECTION_ERRORS: tuple[type[BaseException], ...] = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.ConnectionFailureError,
+)
+
+
+class AcquireContext:
+    def __init__(
+        self, pool: asyncpg.Pool, name: str, timeout: float | None = None
+    ) -> None:
+        self.pool = pool
+        self.name = name
+        self.timeout = timeout
+        self.connection: asyncpg.Connection | None = None
+
+    async def acquire(self) -> asyncpg.Connection:
+        start = time.perf_counter()
+        connection = await self.pool.acquire(timeout=self.timeout)
+        duration = time.perf_counter() - start
+        pool_acquire_duration.observe(duration, pool=self.name)
+        # a slow acquire means the pool is exhausted rather than a slow query
+        query_log.record(f'acquire {self.name}', duration)
+        return connection
+
+    def __await__(self) -> Generator[Any, None, asyncpg.Connection]:
+        return self.acquire().__await__()
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.connection = await self.acquire()
+        return self.connection
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.pool.release(self.connection)
+
+
+class DatabaseRouter:
+    def __init__(
+        self,
+        primary: asyncpg.Pool,
+        replicas: Iterable[asyncpg.Pool] = (),
+        *,
+        health_check_interval: float = REPLICA_HEALTH_CHECK_INTERVAL,
+        health_check_timeout: float = REPLICA_HEALTH_CHECK_TIMEOUT,
+        pin_ttl: float = REPLICA_PIN_TTL,
+    ) -> None:
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.healthy: list[asyncpg.Pool] = list(self.replicas)
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        # keys written recently, read from the primary until replicas catch up
+        self.pinned: TTLCache[str, bool] = TTLCache(
+            ttl=pin_ttl, max_size=REPLICA_PIN_SIZE
+        )
+        self.counter = itertools.count()
+        self.task: asyncio.Task[None] | None = None
+
+    # writes and anything else that expects a pool go to the primary
+
+    def acquire(self, *, timeout: float | None = None) -> AcquireContext:
+        return AcquireContext(self.primary, 'primary', timeout)
+
+    async def release(
+        self, connection: asyncpg.Connection, *, timeout: float | None = None
+    ) -> None:
+        await self.primary.release(connection, timeout=timeout)
+
+    def pin(self, *keys: str) -> None:
+        for key in keys:
+            self.pinned.set(key, True)
+
+    def is_pinned(self, keys: Iterable[str]) -> bool:
+        return any(self.pinned.get(key) for key in keys)
+
+    def replica(self) -> asyncpg.Pool:
+        if not self.healthy:
+            return self.primary
+        return self.healthy[next(self.counter) % len(self.healthy)]
+
+    def mark_unhealthy(self, replica: asyncpg.Pool) -> None:
+        if replica in self.healthy:
+            self.healthy.remove(replica)
+            _log.warning('Replica %s is unhealthy, reading from the primary', replica)
+
+    @contextlib.asynccontextmanager
+    async def acquire_replica(self) -> AsyncIterator[asyncpg.Connection]:
+        pool = self.replica()
+        if pool is self.primary:
+            connection = await AcquireContext(pool, 'primary')
+        else:
+            try:
+                connection = await AcquireContext(
+                    pool, 'replica', self.health_check_timeout
+                )
+            except asyncio.TimeoutError:
+                # a busy replica isn't a broken one, the health check catches hangs
+                pool = self.primary
+                connection = await AcquireContext(pool, 'primary')
+            except CONNECTION_ERRORS:
+                self.mark_unhealthy(pool)
+                pool = self.primary
+                connection = await AcquireContext(pool, 'primary')
+        try:
+            yield connection
+        finally:
+            await pool.release(connection)
+
+    async def check(self, replica: asyncpg.Pool) -> bool:
+        try:
+            async with replica.acquire(timeout=self.health_check_timeout) as conn:
+                await conn.fetchval('SELECT 1', timeout=self.health_check_timeout)
+        except CONNECTION_ERRORS + (asyncpg.PostgresError,):
+            return False
+        return True
+
+    async def check_health(self) -> None:
+        results = await asyncio.gather(*map(self.check, self.replicas))
+        healthy = [replica for replica, ok in zip(self.replicas, results) if ok]
+        for replica in healthy:
+            if replica not in self.healthy:
+                _log.info('Replica %s is healthy again', replica)
+        for replica in self.healthy:
+            if replica not in healthy:
+                _log.warning('Replica %s failed its health check', replica)
+        self.healthy = healthy
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.check_health()
+            except Exception:
+                _log.exception('Replica health check failed')
+
+    def start(self) -> None:
+        if self.replicas:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        await asyncio.gather(
+            *(replica.close() for replica in self.replicas), self.primary.close()
+        )
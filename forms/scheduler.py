@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import heapq
+import logging
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+import discord
+import orjson
+
+from .constants import (
+    DEADLINES_CHANNEL,
+    FINISH_RETRY_DELAY,
+    FINISH_RETRY_MAX_DELAY,
+    SCHEDULER_MAX_SLEEP,
+)
+from .database import get_deadlines
+
+if TYPE_CHECKING:
+    import asyncpg
+
+    from ._types import Pool
+
+
+_log = logging.getLogger(__name__)
+
+
+class FormScheduler:
+    def __init__(
+        self,
+        pool: Pool,
+        on_due: Callable[[list[str]], Awaitable[None]],
+    ) -> None:
+        self.pool = pool
+        self.on_due = on_due
+        self.deadlines: dict[str, datetime.datetime] = {}
+        self.heap: list[tuple[datetime.datetime, str]] = []
+        # form_id -> times its results have failed to send
+        self.retries: dict[str, int] = {}
+        self.wakeup = asyncio.Event()
+        self.connection: asyncpg.Connection | None = None
+        self.task: asyncio.Task[None] | None = None
+
+    def add(self, form_id: str, finishes_at: datetime.datetime) -> None:
+        self.deadlines[form_id] = finishes_at
+        heapq.heappush(self.heap, (finishes_at, form_id))
+        if self.heap[0][1] == form_id:
+            self.wakeup.set()
+
+    def remove(self, form_id: str) -> None:
+        # the heap entry is skipped once it no longer matches self.deadlines
+        self.deadlines.pop(form_id, None)
+        self.retries.pop(form_id, None)
+
+    def retry(self, form_ids: list[str]) -> None:
+        # forms that weren't finished stay open, so try again with a backoff
+        for form_id in form_ids:
+            retries = self.retries[form_id] = self.retries.get(form_id, 0) + 1
+            delay = min(FINISH_RETRY_DELAY * 2 ** (retries - 1), FINISH_RETRY_MAX_DELAY)
+            _log.warning('Form %s was not finished, retrying in %.0fs', form_id, delay)
+            self.add(
+                form_id, discord.utils.utcnow() + datetime.timedelta(seconds=delay)
+            )
+
+    def pop_due(self) -> list[str]:
+        now = discord.utils.utcnow()
+        due: list[str] = []
+        while self.heap and self.heap[0][0] <= now:
+            finishes_at, form_id = heapq.heappop(self.heap)
+            if self.deadlines.get(form_id) == finishes_at:
+                del self.deadlines[form_id]
+                due.append(form_id)
+        return due
+
+    def on_notification(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        data = orjson.loads(payload)
+        if data['finishes_at'] is None:
+            self.remove(data['form_id'])
+        else:
+            self.add(
+                data['form_id'], datetime.datetime.fromisoformat(data['finishes_at'])
+            )
+
+    async def connect(self) -> None:
+        self.connection = await self.pool.acquire()
+        await self.connection.add_listener(DEADLINES_CHANNEL, self.on_notification)
+
+        # listening first means no deadline is missed between the two
+        self.deadlines.clear()
+        self.heap.clear()
+        self.retries.clear()
+        for row in await get_deadlines(self.pool):
+            self.add(row['form_id'], row['finishes_at'])
+
+    async def disconnect(self) -> None:
+        if self.connection is None:
+            return
+        if not self.connection.is_closed():
+            await self.connection.remove_listener(
+                DEADLINES_CHANNEL, self.on_notification
+            )
+        await self.pool.release(self.connection)
+        self.connection = None
+
+    async def run(self) -> None:
+        while True:
+            if self.connection is None or self.connection.is_closed():
+                await self.disconnect()
+                await self.connect()
+
+            self.wakeup.clear()
+            if due := self.pop_due():
+                try:
+                    await self.on_due(due)
+                except Exception:
+                    _log.exception('Failed to finish forms %s', due)
+
+            timeout = SCHEDULER_MAX_SLEEP
+            if self.heap:
+                until = (self.heap[0][0] - discord.utils.utcnow()).total_seconds()
+                timeout = max(0, min(timeout, until))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        await self.connect()
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.disconnect()
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Protocol
+
+import aiofiles
+import aiohttp
+import orjson
+
+from .constants import (
+    TRACE_EXPORT_INTERVAL,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_QUEUE_SIZE,
+    TRACE_SAMPLE_RATE,
+)
+
+if TYPE_CHECKING:
+    from discord.state import ConnectionState
+
+
+_log = logging.getLogger(__name__)
+
+INTERNAL = 'internal'
+SERVER = 'server'
+CLIENT = 'client'
+
+# OTLP's SpanKind enum
+OTLP_KINDS: dict[str, int] = {INTERNAL: 1, SERVER: 2, CLIENT: 3}
+
+# copied into every task created inside a span, so traces follow create_task
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    'current_span', default=None
+)
+
+
+class Span:
+    __slots__ = (
+        'name',
+        'trace_id',
+        'span_id',
+        'parent_id',
+        'kind',
+        'start',
+        'end',
+        'attributes',
+        'error',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: str | None,
+        kind: str,
+        attributes: dict[str, Any],
+        start: int | None = None,
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start = time.time_ns() if start is None else start
+        self.end: int | None = None
+        self.attributes = attributes
+        self.error: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'kind': self.kind,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': ((self.end or self.start) - self.start) / 1e6,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Exporter(Protocol):
+    async def export(self, spans: list[Span]) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class JSONLinesExporter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    async def export(self, spans: list[Span]) -> None:
+        async with aiofiles.open(self.path, 'ab') as f:
+            await f.write(
+                b''.join(
+                    orjson.dumps(
+                        span.to_dict(),
+                        option=orjson.OPT_APPEND_NEWLINE,
+                        default=str,
+                    )
+                    for span in spans
+                )
+            )
+
+    async def close(self) -> None:
+        pass
+
+
+def format_otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def format_otlp_span(span: Span) -> dict[str, Any]:
+    data: dict[str, Any] = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': OTLP_KINDS[span.kind],
+        'startTimeUnixNano': str(span.start),
+        'endTimeUnixNano': str(span.end),
+        'attributes': [
+            {'key': key, 'value': format_otlp_value(value)}
+            for key, value in span.attributes.items()
+        ],
+        'status': {'code': 1}
+        if span.error is None
+        else {'code': 2, 'message': span.error},
+    }
+    if span.parent_id is not None:
+        data['parentSpanId'] = span.parent_id
+    return data
+
+
+class OTLPExporter:
+    # OTLP/HTTP with the JSON encoding, which any local collector accepts
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT) -> None:
+        self.endpoint = endpoint
+        self.session: aiohttp.ClientSession | None = None
+
+    async def export(self, spans: list[Span]) -> None:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        payload = {
+            'resourceSpans': [
+                {
+                    'resource': {
+                        'attributes': [
+                            {'key': 'service.name', 'value': {'stringValue': 'forms'}}
+                        ]
+                    },
+                    'scopeSpans': [
+                        {
+                            'scope': {'name': 'forms'},
+                            'spans': [format_otlp_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        async with self.session.post(
+            self.endpoint,
+            data=orjson.dumps(payload, default=str),
+            headers={'Content-Type': 'application/json'},
+        ) as response:
+            response.raise_for_status()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class Tracer:
+    def __init__(
+        self,
+        *,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        interval: float = TRACE_EXPORT_INTERVAL,
+        max_size: int = TRACE_QUEUE_SIZE,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_size = max_size
+        self.exporters: list[Exporter] = []
+        self.spans: list[Span] = []
+        self.dropped = 0
+        self.task: asyncio.Task[None] | None = None
+
+    def start_span(
+        self, name: str, *, root: bool = False, kind: str = INTERNAL, **attributes: Any
+    ) -> Span | None:
+        parent = current_span.get()
+        if parent is not None:
+            return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+        # only entry points start traces, everything else joins one or is skipped
+        if not root or not self.exporters or random.random() >= self.sample_rate:
+            return None
+        return Span(name, f'{random.getrandbits(128):032x}', None, kind, attributes)
+
+    def end_span(self, span: Span, error: BaseException | None = None) -> None:
+        span.end = time.time_ns()
+        if error is not None:
+            span.error = f'{type(error).__name__}: {error}'
+        if len(self.spans) < self.max_size:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, *, root: bool = False, kind: str = INTERNAL, **attributes: Any
+    ) -> Iterator[Span | None]:
+        span = self.start_span(name, root=root, kind=kind, **attributes)
+        if span is None:
+            yield None
+            return
+
+        token = current_span.set(span)
+        error = None
+        try:
+            yield span
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            current_span.reset(token)
+            self.end_span(span, error)
+
+    def add_span(self, name: str, duration: float, **attributes: Any) -> None:
+        # for work that was timed already, such as each query
+        parent = current_span.get()
+        if parent is None:
+            return
+        start = time.time_ns() - int(duration * 1e9)
+        span = Span(name, parent.trace_id, parent.span_id, CLIENT, attributes, start)
+        self.end_span(span)
+
+    async def export(self) -> None:
+        spans, self.spans = self.spans, []
+        if self.dropped:
+            _log.warning('Dropped %s spans, the export queue was full', self.dropped)
+            self.dropped = 0
+        if not spans:
+            return
+        for exporter in self.exporters:
+            try:
+                await exporter.export(spans)
+            except Exception:
+                _log.exception('Failed to export %s spans', len(spans))
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.export()
+
+    def start(self) -> None:
+        if self.exporters and self.sample_rate:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        await self.export()
+        for exporter in self.exporters:
+            await exporter.close()
+
+
+tracer = Tracer()
+
+
+def trace_gateway_interactions(state: ConnectionState) -> None:
+    # over the gateway no request wraps an interaction, so its root span starts
+    # here and ends once every task the interaction created is done
+    parse: Callable[[Any], None] = state.parsers['INTERACTION_CREATE']
+
+    def parse_interaction_create(data: Any) -> None:
+        span = tracer.start_span('interaction', root=True, kind=SERVER)
+        if span is None:
+            return parse(data)
+
+        before = asyncio.all_tasks()
+        token = current_span.set(span)
+        try:
+            parse(data)
+        finally:
+            current_span.reset(token)
+        pending = asyncio.all_tasks() - before
+        if not pending:
+            tracer.end_span(span)
+            return
+
+        def on_done(task: asyncio.Task[Any]) -> None:
+            pending.discard(task)
+            if not pending:
+                tracer.end_span(span)  # type: ignore
+
+        for task in pending:
+            task.add_done_callback(on_done)
+
+    state.parsers['INTERACTION_CREATE'] = parse_interaction_create
@@ -5,7 +5,7 @@ from typing import TYPE_CHECKING, Iterable
 import discord
 
 from ..constants import COLOR
-from ..database import get_responses_channel, insert_responses
+from ..database import get_responses_channel
 
 if TYPE_CHECKING:
     from .._types import Interaction, Item
@@ -27,13 +27,12 @@ class FormModal(discord.ui.Modal):
 
         child: discord.ui.TextInput
         for number, child in enumerate(self.children):
-            question_id = f'{interaction.guild.id}{self.title}{number}'
+            question_id = f'{interaction.guild_id}{self.title}{number}'
             response = child.value
             question_ids.append(question_id)
             responses.append(response)
 
-        await insert_responses(
-            interaction.client.pool,
+        interaction.client.response_buffer.add(
             response_time=discord.utils.utcnow(),
             user=str(interaction.user),
             question_ids=question_ids,
@@ -41,7 +40,7 @@ class FormModal(discord.ui.Modal):
         )
 
         channel_id = await get_responses_channel(
-            interaction.client.pool, form_id=f'{interaction.guild.id}{self.title}'
+            interaction.client.pool, form_id=f'{interaction.guild_id}{self.title}'
         )
         if channel_id is not None:
             embed = discord.Embed(timestamp=discord.utils.utcnow(), color=COLOR)
@@ -53,8 +52,8 @@ class FormModal(discord.ui.Modal):
                     name=child.label, value=discord.utils.escape_markdown(child.value)
                 )
             try:
-                channel = interaction.client.getch(
-                    interaction.guild.get_channel, channel_id
+                channel = await interaction.client.getch(
+                    interaction.client.get_channel, channel_id
                 )
             except discord.HTTPException:
                 return
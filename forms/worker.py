@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import socket
+from typing import TYPE_CHECKING
+
+import discord
+
+from .constants import (
+    COLOR,
+    JOB_LEASE,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETRY_DELAY,
+    JOB_SETTLE_DELAY,
+    JOBS_CHANNEL,
+)
+from .database import (
+    delete_finish_job,
+    fail_finish_job,
+    lease_finish_jobs,
+    renew_finish_jobs,
+)
+from .export import ExportFormat
+from .finish_form import FinishRequest
+
+if TYPE_CHECKING:
+    import asyncpg
+
+    from .bot import FormsBot
+
+
+_log = logging.getLogger(__name__)
+
+
+class FinishWorker:
+    def __init__(
+        self,
+        bot: FormsBot,
+        *,
+        worker_id: str | None = None,
+        lease: float = JOB_LEASE,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_delay: float = JOB_RETRY_DELAY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        settle_delay: float = JOB_SETTLE_DELAY,
+    ) -> None:
+        self.bot = bot
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease = datetime.timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self.retry_delay = datetime.timedelta(seconds=retry_delay)
+        self.poll_interval = poll_interval
+        # serving processes buffer responses, give them time to flush a form's
+        # last ones before it's finished here
+        self.settle_delay = datetime.timedelta(seconds=settle_delay)
+        self.slots = asyncio.Semaphore(bot.finishing_pipeline.concurrency)
+        self.wakeup = asyncio.Event()
+        self.connection: asyncpg.Connection | None = None
+        self.task: asyncio.Task[None] | None = None
+        self.processing: set[asyncio.Task[None]] = set()
+
+    def on_notification(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        # the new job can only be leased once it has settled
+        asyncio.get_running_loop().call_later(
+            self.settle_delay.total_seconds(), self.wakeup.set
+        )
+
+    async def connect(self) -> None:
+        self.connection = await self.bot.pool.acquire()
+        await self.connection.add_listener(JOBS_CHANNEL, self.on_notification)
+
+    async def disconnect(self) -> None:
+        if self.connection is None:
+            return
+        if not self.connection.is_closed():
+            await self.connection.remove_listener(JOBS_CHANNEL, self.on_notification)
+        await self.bot.pool.release(self.connection)
+        self.connection = None
+
+    async def renew(self, form_ids: list[str]) -> None:
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            # one failure mustn't end the renewals, or the lease would run out
+            # mid upload and another worker would send the results again
+            try:
+                await renew_finish_jobs(
+                    self.bot.pool,
+                    worker_id=self.worker_id,
+                    form_ids=form_ids,
+                    lease=self.lease,
+                )
+            except Exception:
+                _log.exception('Failed to renew the leases of %s', form_ids)
+
+    async def process(self, jobs: list[asyncpg.Record]) -> None:
+        requests = [
+            FinishRequest(
+                form_id=job['form_id'],
+                form_name=job['form_name'],
+                guild_id=job['guild_id'],
+                creator_id=job['creator_id'],
+                response_channel_id=job['channel_id'] or job['response_channel_id'],
+                export_format=job['export_format']
+                and ExportFormat(job['export_format']),
+            )
+            for job in jobs
+        ]
+        renew = asyncio.create_task(self.renew([job['form_id'] for job in jobs]))
+        error = 'The results could not be sent'
+        try:
+            finished = await self.bot.finishing_pipeline.run(requests)
+        except Exception as exc:
+            _log.exception('Failed to finish jobs %s', [job['form_id'] for job in jobs])
+            finished = []
+            error = repr(exc)
+        finally:
+            renew.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await renew
+
+        for job in jobs:
+            if job['form_id'] in finished:
+                continue
+            if job['attempts'] >= self.max_attempts:
+                _log.error(
+                    'Giving up on %s after %s attempts', job['form_id'], job['attempts']
+                )
+                # the form and its responses stay, /finish can queue a new job
+                await delete_finish_job(
+                    self.bot.pool, worker_id=self.worker_id, form_id=job['form_id']
+                )
+                await self.notify_creator(job)
+                continue
+            await fail_finish_job(
+                self.bot.pool,
+                worker_id=self.worker_id,
+                form_id=job['form_id'],
+                error=error,
+                retry_delay=self.retry_delay,
+            )
+
+    async def notify_creator(self, job: asyncpg.Record) -> None:
+        embed = discord.Embed(
+            title=f'{job["form_name"]} could not be finished',
+            description=(
+                f'The results could not be sent after {job["attempts"]} attempts. '
+                'The responses have been kept, use /finish to try again.'
+            ),
+            color=COLOR,
+        )
+        try:
+            creator = await self.bot.getch(self.bot.get_user, job['creator_id'])
+            await creator.send(embed=embed)
+        except discord.HTTPException:
+            _log.warning('Failed to tell the creator of %s', job['form_id'])
+
+    async def run(self) -> None:
+        while True:
+            if self.connection is None or self.connection.is_closed():
+                await self.disconnect()
+                await self.connect()
+
+            self.wakeup.clear()
+            await self.slots.acquire()
+            try:
+                jobs = await lease_finish_jobs(
+                    self.bot.pool,
+                    worker_id=self.worker_id,
+                    lease=self.lease,
+                    max_attempts=self.max_attempts,
+                    limit=self.bot.finishing_pipeline.batch_size,
+                    settle_delay=self.settle_delay,
+                )
+            except Exception:
+                _log.exception('Failed to lease jobs')
+                jobs = []
+
+            if not jobs:
+                self.slots.release()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self.process(jobs))
+            task.add_done_callback(lambda _: self.slots.release())
+            self.processing.add(task)
+            task.add_done_callback(self.processing.discard)
+
+    async def start(self) -> None:
+        await self.connect()
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        for task in self.processing:
+            task.cancel()
+        await asyncio.gather(*self.processing, return_exceptions=True)
+        await self.disconnect()